@@ -0,0 +1,4 @@
+"""
+Benchmarks for the API. Run them from the repository root, for example
+`python -m benchmarks.serialization`.
+"""
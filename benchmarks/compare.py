@@ -0,0 +1,37 @@
+"""
+Compare two benchmark result files route by route.
+
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import json
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print('%s (%s) -> %s (%s)' % (args.before, before['meta'].get('commit', '?')[:10],
+                                  args.after, after['meta'].get('commit', '?')[:10]))
+    print('%-22s %21s %21s %21s' % ('route', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for route in sorted(set(before['routes']) | set(after['routes'])):
+        old, new = before['routes'].get(route), after['routes'].get(route)
+        if old is None or new is None:
+            print('%-22s only in %s' % (route, args.after if old is None else args.before))
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            cells.append('%7.2f -> %7.2f %+4.0f%%' % (old[key], new[key], change))
+        print('%-22s %s' % (route, ' '.join(cells)))
+    print('%-22s %.1f -> %.1f req/s' % ('total', before['total']['rps'], after['total']['rps']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+Seed a database with a synthetic restaurant history, replay a scripted
+service day against the API and write per-route latency and throughput as
+JSON, so runs can be compared between commits with benchmarks.compare.
+
+    python -m benchmarks.run --scale 0.05 --output before.json
+    python -m benchmarks.run --url http://127.0.0.1:3000 --concurrency 8 --no-seed
+
+By default the replay goes through the Flask test client, in process, on a
+SQLite file. --database-url selects another database (for example a local
+PostgreSQL). With --url it replays over HTTP against a server started on the
+same database, e.g. `gunicorn -c gunicorn.conf.py wsgi --chdir ./src/`.
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+from .seed import DEFAULT_VOLUMES
+from .throughput import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_app(database_url):
+    os.environ['DATABASE_URL'] = database_url
+    sys.path.insert(0, os.path.join(ROOT, 'src'))
+    from app import create_app
+    return create_app({'ENABLE_ADMIN': False, 'ENABLE_MIGRATE': False})
+
+def test_client_sender(app):
+    client = app.test_client()
+
+    def send(method, path, body, headers):
+        response = client.open(path, method=method, json=body, headers=headers)
+        data = response.get_data()
+        return response.status_code, json.loads(data) if response.is_json and data else None
+    return send
+
+def http_sender(url):
+    parts = urlsplit(url)
+    local = threading.local()
+
+    def send(method, path, body, headers):
+        if getattr(local, 'connection', None) is None:
+            local.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            local.connection.request(method, path, payload, headers)
+            response = local.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            local.connection.close()
+            local.connection = None
+            return 599, None
+        is_json = (response.getheader('Content-Type') or '').startswith('application/json')
+        return response.status, json.loads(data) if is_json and data else None
+    return send
+
+def replay(steps, send, concurrency, seeded_orders):
+    created = {}
+    results = {}
+    lock = threading.Lock()
+
+    def resolve(order_ref):
+        # An order created by another client that is not done yet falls back to a seeded one
+        return created.get(order_ref, order_ref % seeded_orders + 1)
+
+    def run(my_steps):
+        mine = []
+        for index, step in my_steps:
+            path, body = step['path'], step['json']
+            if step['order_ref'] is not None:
+                order_id = resolve(step['order_ref'])
+                path = path.replace('{order}', str(order_id))
+                if body is not None and 'order_id' in body:
+                    body = dict(body, order_id=order_id)
+            started = time.perf_counter()
+            status, data = send(step['method'], path, body, step['headers'])
+            elapsed = time.perf_counter() - started
+            if step['route'] == 'create_order' and status == 201:
+                with lock:
+                    created[len(created)] = data['id']
+            mine.append((step['route'], elapsed, status))
+        with lock:
+            for route, elapsed, status in mine:
+                entry = results.setdefault(route, {'latencies': [], 'errors': 0})
+                entry['latencies'].append(elapsed)
+                entry['errors'] += status >= 400
+
+    # Client n replays every concurrency-th step, so all clients follow the same evening
+    indexed = list(enumerate(steps))
+    threads = [threading.Thread(target=run, args=(indexed[n::concurrency],)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+def summarize(results, seconds):
+    routes = {}
+    for route, entry in sorted(results.items()):
+        latencies = entry['latencies']
+        routes[route] = {
+            'count': len(latencies),
+            'errors': entry['errors'],
+            'rps': round(len(latencies) / seconds, 1),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        }
+    requests = sum(route['count'] for route in routes.values())
+    total = {
+        'requests': requests,
+        'errors': sum(route['errors'] for route in routes.values()),
+        'seconds': round(seconds, 3),
+        'rps': round(requests / seconds, 1),
+    }
+    return routes, total
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-url', default='sqlite:///' + os.path.join(tempfile.gettempdir(), 'villasofia-benchmark.db'))
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier of the seeded volumes')
+    parser.add_argument('--orders', type=int, default=300, help='orders created during the replayed day')
+    parser.add_argument('--url', help='replay over HTTP against this server instead of the test client')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--no-seed', action='store_true', help='reuse a database seeded by an earlier run')
+    parser.add_argument('--output', default='benchmark-results.json')
+    args = parser.parse_args()
+
+    from .seed import seed
+    from .service_day import build_script
+    volumes = {name: max(1, int(value * args.scale)) for name, value in DEFAULT_VOLUMES.items()}
+    volumes['users'] = DEFAULT_VOLUMES['users']
+
+    if args.database_url.startswith('sqlite:///') and not args.no_seed:
+        path = args.database_url[len('sqlite:///'):]
+        if os.path.exists(path):
+            os.remove(path)
+
+    app = load_app(args.database_url)
+    from models import db, Order
+    with app.app_context():
+        seed_seconds = None
+        if args.no_seed:
+            seeded_orders = db.session.query(Order).count()
+            from models import FoodItem, StoreItem, AquaticItem
+            catalog_sizes = {'food': FoodItem.query.count(), 'store': StoreItem.query.count(), 'aquatic': AquaticItem.query.count()}
+        else:
+            db.drop_all()
+            db.create_all()
+            started = time.perf_counter()
+            counts, catalog_sizes = seed(db, volumes)
+            seed_seconds = round(time.perf_counter() - started, 1)
+            seeded_orders = counts['order']
+            print('seeded %s in %.1f s' % (counts, seed_seconds))
+        dialect = db.engine.dialect.name
+
+    steps = build_script(catalog_sizes, seeded_orders, orders=args.orders)
+    send = http_sender(args.url) if args.url else test_client_sender(app)
+    results, seconds = replay(steps, send, args.concurrency, seeded_orders)
+    routes, total = summarize(results, seconds)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'target': args.url or 'testclient',
+            'database': dialect,
+            'volumes': volumes,
+            'orders': args.orders,
+            'concurrency': args.concurrency,
+            'seed_seconds': seed_seconds,
+        },
+        'total': total,
+        'routes': routes,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print('%-22s %6s %6s %8s %8s %8s %8s' % ('route', 'count', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for route, entry in routes.items():
+        print('%-22s %6d %6d %8.1f %8.2f %8.2f %8.2f' % (
+            route, entry['count'], entry['errors'], entry['rps'], entry['p50_ms'], entry['p95_ms'], entry['p99_ms']))
+    print('%d requests in %.1f s, %.1f req/s, written to %s' % (total['requests'], total['seconds'], total['rps'], args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Synthetic restaurant history: catalogs, users, past orders with their items,
+closed-order sales totals and the change log, written with bulk inserts.
+
+Every number comes from a seeded random generator, so the same arguments
+always produce the same database.
+"""
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+
+CHUNK_SIZE = 10000
+
+DEFAULT_VOLUMES = {
+    'catalog_items': 3000,
+    'users': 40,
+    'orders': 200000,
+    'changes': 300000,
+}
+
+FOOD_WORDS = ['arepa', 'bandeja', 'ajiaco', 'sancocho', 'empanada', 'patacon', 'mojarra', 'lulo', 'arroz', 'posta']
+STORE_WORDS = ['soda', 'agua', 'cerveza', 'jugo', 'cafe', 'chicle', 'galleta', 'hielo']
+AQUATIC_WORDS = ['kayak', 'paddle', 'chaleco', 'tubo', 'lancha', 'careta']
+CHANGE_TYPES = ['order_created', 'order_updated', 'item_added', 'item_removed', 'price_changed']
+
+def _chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _bulk_insert(db, model, rows):
+    count = 0
+    for chunk in _chunks(rows):
+        db.session.execute(insert(model), chunk)
+        db.session.commit()
+        count += len(chunk)
+    return count
+
+def seed(db, volumes=None, seed_value=42, days=90, now=None):
+    """Fill an empty database created with db.create_all(), return the row counts."""
+    from models import User, Change, Order, OrderItem, FoodItem, StoreItem, AquaticItem, SalesRollup
+
+    volumes = dict(DEFAULT_VOLUMES, **(volumes or {}))
+    rng = random.Random(seed_value)
+    now = now or datetime(2026, 10, 1, 23, 0)
+    start = now - timedelta(days=days)
+
+    # Half of the catalog is food, the rest store and aquatic items. Stock is large
+    # so the replayed service day never runs out.
+    catalog_sizes = {
+        'food': volumes['catalog_items'] // 2,
+        'store': volumes['catalog_items'] * 3 // 10,
+        'aquatic': volumes['catalog_items'] - volumes['catalog_items'] // 2 - volumes['catalog_items'] * 3 // 10,
+    }
+    catalogs = [('food', FoodItem, FOOD_WORDS), ('store', StoreItem, STORE_WORDS), ('aquatic', AquaticItem, AQUATIC_WORDS)]
+    counts = {}
+    prices = {}
+    for item_type, model, words in catalogs:
+        rows = []
+        for i in range(catalog_sizes[item_type]):
+            row = {
+                'name': '%s %s %d' % (rng.choice(words), rng.choice(words), i),
+                'price': round(rng.uniform(1, 60), 2),
+                'quantity': 10 ** 7,
+                'created_at': start,
+                'updated_at': start,
+            }
+            if model is FoodItem:
+                row['status'] = 'available'
+            rows.append(row)
+        prices[item_type] = [row['price'] for row in rows]
+        counts[model.__tablename__] = _bulk_insert(db, model, rows)
+
+    counts['user'] = _bulk_insert(db, User, ({
+        'name': 'Staff %d' % i,
+        'role': 'admin' if i == 0 else rng.choice(['waiter', 'cook', 'cashier']),
+        'user_name': 'staff%d' % i,
+        'password': 'not-a-real-password',
+    } for i in range(volumes['users'])))
+
+    seconds = int((now - start).total_seconds())
+    order_times = sorted(start + timedelta(seconds=rng.randrange(seconds)) for _ in range(volumes['orders']))
+    orders = [{
+        'table_number': rng.randint(1, 30),
+        'number_of_people': rng.randint(1, 8),
+        'created_at': created_at,
+        'updated_at': created_at,
+        'closed_at': created_at + timedelta(minutes=rng.randint(20, 120)),
+    } for created_at in order_times]
+    counts['order'] = _bulk_insert(db, Order, orders)
+
+    # The daily sales totals that closing these orders would have produced
+    rollup = {}
+
+    def order_items():
+        for order_id, order in enumerate(orders, start=1):
+            for _ in range(rng.randint(1, 5)):
+                item_type = rng.choices(['food', 'store', 'aquatic'], weights=[6, 3, 1])[0]
+                item_id = rng.randint(1, catalog_sizes[item_type])
+                quantity = rng.randint(1, 4)
+                key = (order['closed_at'].date(), item_type, item_id, order['table_number'])
+                totals = rollup.setdefault(key, [0, 0.0])
+                totals[0] += quantity
+                totals[1] += quantity * prices[item_type][item_id - 1]
+                yield {'order_id': order_id, 'item_type': item_type, 'item_id': item_id, 'quantity': quantity}
+    counts['order_item'] = _bulk_insert(db, OrderItem, order_items())
+    counts['sales_rollup'] = _bulk_insert(db, SalesRollup, ({
+        'day': day, 'item_type': item_type, 'item_id': item_id, 'table_number': table_number,
+        'quantity': quantity, 'revenue': round(revenue, 2),
+    } for (day, item_type, item_id, table_number), (quantity, revenue) in rollup.items()))
+
+    change_times = sorted(start + timedelta(seconds=rng.randrange(seconds)) for _ in range(volumes['changes']))
+    counts['change'] = _bulk_insert(db, Change, ({
+        'timestamp': timestamp,
+        'user_name': 'staff%d' % rng.randrange(volumes['users']),
+        'change_type': rng.choice(CHANGE_TYPES),
+        'change_data': '{"order_id": %d}' % rng.randint(1, volumes['orders']),
+    } for timestamp in change_times))
+
+    return counts, catalog_sizes
@@ -0,0 +1,64 @@
+"""
+Micro-benchmark of the list serialization paths: the ORM serialize() + Flask
+encoder path against the ?fields= column projection + fast encoder path.
+
+    python -m benchmarks.serialization --rows 20000 --repeat 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(), 'serialization.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + database
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+    from datetime import datetime
+    from sqlalchemy import insert
+    from app import create_app
+    from models import db, FoodItem
+    from utils import fast_dumps, orjson
+
+    app = create_app({'ENABLE_ADMIN': False, 'ENABLE_MIGRATE': False})
+    with app.app_context():
+        db.create_all()
+        now = datetime.now()
+        db.session.execute(insert(FoodItem), [{
+            'name': 'item %d' % i, 'price': i / 100, 'quantity': i % 50, 'status': 'available',
+            'created_at': now, 'updated_at': now,
+        } for i in range(args.rows)])
+        db.session.commit()
+
+        def orm_serialize():
+            db.session.expunge_all()
+            return app.json.dumps([item.serialize() for item in FoodItem.query.order_by(FoodItem.id).all()])
+
+        def projection():
+            names = ['id', 'name', 'price', 'quantity', 'status', 'created_at', 'updated_at']
+            rows = db.session.query(*[getattr(FoodItem, name) for name in names]).order_by(FoodItem.id).all()
+            return fast_dumps([dict(zip(names, row)) for row in rows])
+
+        def projection_subset():
+            rows = db.session.query(FoodItem.id, FoodItem.name, FoodItem.price).order_by(FoodItem.id).all()
+            return fast_dumps([dict(zip(('id', 'name', 'price'), row)) for row in rows])
+
+        assert orm_serialize() and projection()
+        print('%d rows, best of %d, encoder: %s' % (args.rows, args.repeat, 'orjson' if orjson else 'json'))
+        baseline = None
+        for name, function in [('serialize()', orm_serialize),
+                               ('?fields= all columns', projection),
+                               ('?fields=id,name,price', projection_subset)]:
+            best = min(timeit.repeat(function, number=1, repeat=args.repeat))
+            baseline = baseline or best
+            print('%-24s %8.1f ms  %5.1fx' % (name, best * 1000, baseline / best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Scripted service day: the requests the tablets, the kitchen screen and the
+back office send during one evening, in order.
+
+Each step names the Flask endpoint it hits, so results group by route.
+Steps that act on an order created earlier in the day carry 'order_ref',
+the index of that order among the ones created by the replay.
+"""
+import random
+from datetime import date, timedelta
+
+def build_script(catalog_sizes, seeded_orders, orders=300, tablets=8, seed_value=7, report_day=date(2026, 10, 1)):
+    rng = random.Random(seed_value)
+    steps = []
+
+    def step(route, method, path, json=None, order_ref=None, headers=None):
+        steps.append({'route': route, 'method': method, 'path': path, 'json': json,
+                      'order_ref': order_ref, 'headers': headers})
+
+    def random_item():
+        item_type = rng.choices(['food', 'store', 'aquatic'], weights=[6, 3, 1])[0]
+        return {'item_type': item_type, 'item_id': rng.randint(1, catalog_sizes[item_type]), 'quantity': rng.randint(1, 3)}
+
+    # Opening: every tablet loads the staff list and the menus
+    for _ in range(tablets):
+        step('get_users', 'GET', '/users')
+        step('get_food_items', 'GET', '/fooditems')
+        step('get_store_items', 'GET', '/storeitems')
+        step('get_aquatic_items', 'GET', '/aquaticitems')
+
+    open_orders = []
+    for created in range(orders):
+        step('create_order', 'POST', '/orders', {
+            'table_number': rng.randint(1, 30),
+            'number_of_people': rng.randint(1, 8),
+            'items': [random_item() for _ in range(rng.randint(1, 5))],
+        })
+        step('register_change', 'POST', '/changes', {
+            'user_name': 'staff%d' % rng.randrange(40), 'change_type': 'order_created', 'change_data': '{}',
+        })
+        open_orders.append(created)
+
+        if rng.random() < 0.5:
+            step('create_order_item', 'POST', '/orderitems', dict(random_item(), order_id=None), order_ref=rng.choice(open_orders))
+        if rng.random() < 0.2:
+            step('update_order', 'PUT', '/orders/{order}', {
+                'table_number': rng.randint(1, 30), 'number_of_people': rng.randint(1, 8),
+            }, order_ref=rng.choice(open_orders))
+        if rng.random() < 0.3:
+            step('get_order', 'GET', '/orders/{order}?expand=items', order_ref=rng.choice(open_orders))
+
+        # The kitchen screen refreshes the latest orders, the tablets reopen the menus
+        if created % 5 == 0:
+            step('get_orders', 'GET', '/orders?after=%d&limit=50&expand=items' % max(0, seeded_orders - 50))
+        if created % 3 == 0:
+            step('get_food_items', 'GET', '/fooditems')
+            step('get_store_items', 'GET', '/storeitems')
+        if created % 25 == 0:
+            step('get_order_items', 'GET', '/orderitems?after=%d&limit=100' % rng.randrange(seeded_orders))
+            food_id = rng.randint(1, catalog_sizes['food'])
+            step('update_food_item', 'PUT', '/fooditems/%d' % food_id, {
+                'name': 'special %d' % food_id, 'price': round(rng.uniform(5, 40), 2), 'quantity': 10 ** 7, 'status': 'available',
+            })
+
+        # Tables leave about 10 orders after they came in
+        if len(open_orders) > 10:
+            step('close_order', 'POST', '/orders/{order}/close', order_ref=open_orders.pop(0))
+
+    for order_ref in open_orders:
+        step('close_order', 'POST', '/orders/{order}/close', order_ref=order_ref)
+
+    # Closing: the back office pulls the reports of the month
+    month_start = (report_day - timedelta(days=30)).isoformat()
+    for group_by in ('day', 'item', 'item_type', 'table'):
+        step('get_sales_report', 'GET', '/reports/sales?from=%s&to=%s&group_by=%s' % (month_start, report_day.isoformat(), group_by))
+
+    return steps
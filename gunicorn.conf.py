@@ -0,0 +1,33 @@
+"""
+Gunicorn settings. Every value can be changed from the environment.
+
+GUNICORN_WORKER_CLASS picks the concurrency model of each worker:
+- gthread (default): GUNICORN_THREADS requests at a time per worker.
+- gevent: up to GUNICORN_WORKER_CONNECTIONS requests per worker on greenlets.
+- sync: one request at a time, a slow query blocks the worker. /orders/stream
+  refuses to run on it, an open stream would hold the only request slot.
+  Needs GUNICORN_THREADS=1, gunicorn runs gthread when there are more threads.
+
+The database pool of each worker is sized from the same variables in
+src/app.py, see "High-concurrency mode" in the README.
+"""
+import os
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 100))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:%s' % os.getenv('PORT', '8000'))
+
+def post_fork(server, worker):
+    # psycopg2 is a C driver, gevent can only switch greenlets during its queries once patched
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            server.log.warning('psycogreen is not installed, database calls will block the gevent worker')
+        else:
+            patch_psycopg()
@@ -0,0 +1,35 @@
+"""add indexes on the catalog updated_at columns for /catalog?updated_since=
+
+Revision ID: 2b8e6f0c4d91
+Revises: 9d4f2b7c6a15
+Create Date: 2026-10-18 11:58:14.671205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b8e6f0c4d91'
+down_revision = '9d4f2b7c6a15'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_food_item_updated_at', 'food_item', ['updated_at']),
+    ('ix_store_item_updated_at', 'store_item', ['updated_at']),
+    ('ix_aquatic_item_updated_at', 'aquatic_item', ['updated_at']),
+]
+
+
+def upgrade():
+    # CONCURRENTLY (PostgreSQL) builds the indexes without blocking writes, it can't run in a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,38 @@
+"""add indexes on the filtered and joined columns
+
+Revision ID: 3f6b1c2d8e47
+Revises: a7d94e30cf14
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6b1c2d8e47'
+down_revision = 'a7d94e30cf14'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_change_timestamp', 'change', ['timestamp']),
+    ('ix_change_user_name', 'change', ['user_name']),
+    ('ix_order_table_number', 'order', ['table_number']),
+    ('ix_order_created_at', 'order', ['created_at']),
+    ('ix_order_item_order_id', 'order_item', ['order_id']),
+    ('ix_order_item_item_type_item_id', 'order_item', ['item_type', 'item_id']),
+]
+
+
+def upgrade():
+    # CONCURRENTLY (PostgreSQL) builds the indexes without blocking writes, it can't run in a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,41 @@
+"""add trigram indexes on the catalog item names for /search (PostgreSQL)
+
+Revision ID: 9d4f2b7c6a15
+Revises: e5a3c9d2b718
+Create Date: 2026-10-18 11:41:52.208734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4f2b7c6a15'
+down_revision = 'e5a3c9d2b718'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_food_item_name_trgm', 'food_item'),
+    ('ix_store_item_name_trgm', 'store_item'),
+    ('ix_aquatic_item_name_trgm', 'aquatic_item'),
+]
+
+
+def upgrade():
+    # Other databases search an in-memory index (src/search.py)
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    with op.get_context().autocommit_block():
+        for name, table in INDEXES:
+            op.create_index(name, table, ['name'], unique=False, postgresql_using='gin',
+                            postgresql_ops={'name': 'gin_trgm_ops'}, postgresql_concurrently=True)
+
+
+def downgrade():
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    with op.get_context().autocommit_block():
+        for name, table in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,31 @@
+"""add the version column used by the PATCH routes
+
+Revision ID: c3f8a1d6e204
+Revises: 4e9b2d7c1f60
+Create Date: 2026-10-18 13:24:51.880316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f8a1d6e204'
+down_revision = '4e9b2d7c1f60'
+branch_labels = None
+depends_on = None
+
+TABLES = ['user', 'order', 'order_item', 'food_item', 'store_item', 'aquatic_item']
+
+
+def upgrade():
+    # A constant default is catalog-only on PostgreSQL 11+, the tables aren't rewritten
+    for table in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('version')
@@ -67,8 +67,11 @@ def upgrade():
         batch_op.add_column(sa.Column('role', sa.String(length=120), nullable=True))
         batch_op.add_column(sa.Column('date_of_birth', sa.Date(), nullable=True))
         batch_op.add_column(sa.Column('user_name', sa.String(length=120), nullable=True))
-        batch_op.drop_constraint('user_email_key', type_='unique')
-        batch_op.create_unique_constraint(None, ['user_name'])
+        # The name PostgreSQL gave the unique constraint. On SQLite it has no name, and the batch
+        # copy of the table leaves it out anyway once the email column is dropped.
+        if op.get_bind().dialect.name != 'sqlite':
+            batch_op.drop_constraint('user_email_key', type_='unique')
+        batch_op.create_unique_constraint('user_user_name_key', ['user_name'])
         batch_op.drop_column('is_active')
         batch_op.drop_column('email')
 
@@ -80,7 +83,7 @@ def downgrade():
     with op.batch_alter_table('user', schema=None) as batch_op:
         batch_op.add_column(sa.Column('email', sa.VARCHAR(length=120), autoincrement=False, nullable=False))
         batch_op.add_column(sa.Column('is_active', sa.BOOLEAN(), autoincrement=False, nullable=False))
-        batch_op.drop_constraint(None, type_='unique')
+        batch_op.drop_constraint('user_user_name_key', type_='unique')
         batch_op.create_unique_constraint('user_email_key', ['email'])
         batch_op.drop_column('user_name')
         batch_op.drop_column('date_of_birth')
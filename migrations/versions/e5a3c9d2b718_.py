@@ -0,0 +1,35 @@
+"""add indexes on the catalog item names
+
+Revision ID: e5a3c9d2b718
+Revises: b4d7e1a6c529
+Create Date: 2026-10-18 11:24:08.553120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a3c9d2b718'
+down_revision = 'b4d7e1a6c529'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_food_item_name', 'food_item', ['name']),
+    ('ix_store_item_name', 'store_item', ['name']),
+    ('ix_aquatic_item_name', 'aquatic_item', ['name']),
+]
+
+
+def upgrade():
+    # CONCURRENTLY (PostgreSQL) builds the indexes without blocking writes, it can't run in a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,54 @@
+"""store sentinels instead of NULL in the sales rollup key
+
+Revision ID: f2a6d8c4b913
+Revises: c3f8a1d6e204
+Create Date: 2026-10-18 16:02:37.514820
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a6d8c4b913'
+down_revision = 'c3f8a1d6e204'
+branch_labels = None
+depends_on = None
+
+SENTINELS = {'item_type': "''", 'item_id': '0', 'table_number': '-1'}
+
+
+def upgrade():
+    connection = op.get_bind()
+    key = ', '.join(['day'] + ['COALESCE(%s, %s)' % column for column in SENTINELS.items()])
+
+    # The rows the NULLs kept apart are added up into the first one of their key,
+    # before the NULLs become sentinels that the unique constraint would reject
+    duplicates = connection.execute(sa.text(
+        'SELECT MIN(id), SUM(quantity), SUM(revenue), %s FROM sales_rollup GROUP BY %s HAVING COUNT(*) > 1' % (key, key)
+    )).all()
+    for first_id, quantity, revenue, *values in duplicates:
+        connection.execute(sa.text(
+            'DELETE FROM sales_rollup WHERE id != :id AND (%s) = (:day, :item_type, :item_id, :table_number)' % key
+        ), dict(zip(['id', 'day'] + list(SENTINELS), [first_id] + values)))
+        connection.execute(sa.text('UPDATE sales_rollup SET quantity = :quantity, revenue = :revenue WHERE id = :id'),
+                           {'id': first_id, 'quantity': quantity, 'revenue': revenue})
+
+    for column, sentinel in SENTINELS.items():
+        connection.execute(sa.text('UPDATE sales_rollup SET %s = %s WHERE %s IS NULL' % (column, sentinel, column)))
+
+    with op.batch_alter_table('sales_rollup', schema=None) as batch_op:
+        batch_op.alter_column('item_type', existing_type=sa.String(length=50), nullable=False, server_default='')
+        batch_op.alter_column('item_id', existing_type=sa.Integer(), nullable=False, server_default='0')
+        batch_op.alter_column('table_number', existing_type=sa.Integer(), nullable=False, server_default='-1')
+
+
+def downgrade():
+    connection = op.get_bind()
+    for column, sentinel in SENTINELS.items():
+        connection.execute(sa.text('UPDATE sales_rollup SET %s = NULL WHERE %s = %s' % (column, column, sentinel)))
+
+    with op.batch_alter_table('sales_rollup', schema=None) as batch_op:
+        batch_op.alter_column('table_number', existing_type=sa.Integer(), nullable=True, server_default=None)
+        batch_op.alter_column('item_id', existing_type=sa.Integer(), nullable=True, server_default=None)
+        batch_op.alter_column('item_type', existing_type=sa.String(length=50), nullable=True, server_default=None)
@@ -1,22 +1,196 @@
 import os
-from flask_admin import Admin
+import time
+from flask import current_app, flash, request, redirect, url_for
+from flask_admin import Admin, AdminIndexView, expose
+from sqlalchemy import Integer, func, or_, select, false, text
+from sqlalchemy.exc import OperationalError
 from models import db, User, Change, Order, OrderItem, FoodItem, StoreItem, AquaticItem
-from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla import ModelView, filters
+from cache import catalog_cache
+from auth import is_hashed, hash_password, revoke_user_tokens, token_claims, check_password, issue_token, revoke_token
+
+# table name -> (expires at, row count), for the databases without a row estimate
+_counts = {}
+
+def estimated_count(model):
+    # PostgreSQL keeps a row estimate per table, refreshed by autovacuum/ANALYZE
+    table = model.__tablename__
+    if db.engine.dialect.name == 'postgresql':
+        estimate = db.session.execute(text('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:name)'),
+                                      {'name': '"%s"' % table}).scalar()
+        # -1 until the table has been analyzed once
+        if estimate is not None and estimate >= 0:
+            return estimate
+    expires_at, count = _counts.get(table, (0, None))
+    if time.monotonic() >= expires_at:
+        count = db.session.execute(select(func.count()).select_from(model)).scalar()
+        _counts[table] = (time.monotonic() + current_app.config['ADMIN_COUNT_CACHE_SECONDS'], count)
+    return count
+
+
+# The token of the admin login page, only sent back to the panel
+TOKEN_COOKIE = 'admin_token'
+
+def _admin_claims():
+    claims = token_claims(TOKEN_COOKIE)
+    return claims if claims is not None and claims['role'] == 'admin' else None
+
+class AdminOnly:
+    # With AUTH_REQUIRED the panel needs an admin token like the API, from the login page or a proxy
+    def is_accessible(self):
+        return not current_app.config['AUTH_REQUIRED'] or _admin_claims() is not None
+
+    def inaccessible_callback(self, name, **kwargs):
+        return redirect(url_for('admin.login_view', next=request.path))
+
+class IndexView(AdminOnly, AdminIndexView):
+    def _handle_view(self, name, **kwargs):
+        if name in ('login_view', 'logout_view'):
+            return None
+        return super()._handle_view(name, **kwargs)
+
+    @expose('/login/', methods=('GET', 'POST'))
+    def login_view(self):
+        error = None
+        if request.method == 'POST':
+            user = db.session.query(User).filter_by(user_name=request.form.get('user_name', '')).one_or_none()
+            if not check_password(user, request.form.get('password', '')):
+                error = 'Wrong user name or password'
+            elif user.role != 'admin':
+                error = 'The admin panel needs the admin role'
+            else:
+                # Saves the password hashed again, like /login
+                db.session.commit()
+                # Only a path of this site, never another host
+                target = request.args.get('next', '')
+                response = redirect(target if target.startswith('/') and not target.startswith('//') else url_for('admin.index'))
+                response.set_cookie(TOKEN_COOKIE, issue_token(user), max_age=current_app.config['AUTH_TOKEN_MAX_AGE'],
+                                    path=url_for('admin.index'), httponly=True, samesite='Strict', secure=request.is_secure)
+                return response
+        return self.render('admin_login.html', error=error), 401 if error else 200
+
+    @expose('/logout/', methods=('POST',))
+    def logout_view(self):
+        claims = token_claims(TOKEN_COOKIE)
+        if claims is not None:
+            revoke_token(claims)
+        response = redirect(url_for('admin.login_view'))
+        response.delete_cookie(TOKEN_COOKIE, path=url_for('admin.index'))
+        return response
+
+class AdminModelView(AdminOnly, ModelView):
+    pass
+
+class CatalogModelView(AdminModelView):
+    # Edits made in the admin must also invalidate the cached catalogs
+    def after_model_change(self, form, model, is_created):
+        catalog_cache.invalidate(self.model)
+
+    def after_model_delete(self, model):
+        catalog_cache.invalidate(self.model)
+
+class UserView(AdminModelView):
+    # The password typed in the form is hashed like in the API, a hashed one is left alone
+    def on_model_change(self, form, model, is_created):
+        if not is_hashed(model.password):
+            model.password = hash_password(model.password)
+
+    def after_model_change(self, form, model, is_created):
+        if not is_created:
+            revoke_user_tokens(model.id)
+
+    def after_model_delete(self, model):
+        revoke_user_tokens(model.id)
+
+class LargeTableView(AdminModelView):
+    """
+    List views for the tables that grow with every service (orders, their
+    items and the change log). The page shows an estimated row count instead
+    of an exact COUNT(*), filtered pages get a previous/next pager, and
+    sorting, filters and search only use indexed columns, which the
+    subclasses list. Search matches whole values instead of ILIKE '%term%'.
+    On PostgreSQL the queries of a list page are cancelled after
+    ADMIN_STATEMENT_TIMEOUT_MS.
+    """
+    page_size = 50
+    can_set_page_size = False
+    simple_list_pager = True
+    column_default_sort = ('id', True)
+    column_sortable_list = ('id',)
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        try:
+            if db.engine.dialect.name == 'postgresql':
+                timeout = int(current_app.config['ADMIN_STATEMENT_TIMEOUT_MS'])
+                self.session.execute(text('SET LOCAL statement_timeout = %d' % timeout))
+            count, query = super().get_list(page, sort_column, sort_desc, search, filters, execute, page_size)
+            if not search and not filters:
+                count = estimated_count(self.model)
+        except OperationalError:
+            self.session.rollback()
+            flash('The query took too long, narrow it down with a filter.', 'error')
+            return 0, []
+        return count, query
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        for term in search.split():
+            # Numbers match the integer columns, everything else the text ones
+            clauses = [field == (int(term) if isinstance(field.type, Integer) else term)
+                       for field, path in self._search_fields
+                       if term.isdigit() or not isinstance(field.type, Integer)]
+            condition = or_(*clauses) if clauses else false()
+            query = query.filter(condition)
+            if count_query is not None:
+                count_query = count_query.filter(condition)
+        return query, count_query, joins, count_joins
+
+class ChangeView(LargeTableView):
+    column_sortable_list = ('id', 'timestamp', 'user_name')
+    column_searchable_list = ('user_name',)
+    column_filters = (
+        filters.FilterEqual(Change.user_name, 'User name'),
+        filters.DateTimeBetweenFilter(Change.timestamp, 'Timestamp'),
+        filters.DateTimeGreaterFilter(Change.timestamp, 'Timestamp'),
+        filters.DateTimeSmallerFilter(Change.timestamp, 'Timestamp'),
+    )
+
+class OrderView(LargeTableView):
+    column_sortable_list = ('id', 'table_number', 'created_at')
+    column_searchable_list = ('id', 'table_number')
+    column_filters = (
+        filters.IntEqualFilter(Order.table_number, 'Table number'),
+        filters.DateTimeBetweenFilter(Order.created_at, 'Created at'),
+    )
+    # The items are edited on their own page, a select of every order item would not load
+    form_excluded_columns = ('items',)
+
+class OrderItemView(LargeTableView):
+    column_list = ('id', 'order_id', 'item_type', 'item_id', 'quantity')
+    column_sortable_list = ('id', 'order_id')
+    column_searchable_list = ('order_id',)
+    column_filters = (
+        filters.IntEqualFilter(OrderItem.order_id, 'Order id'),
+        filters.FilterEqual(OrderItem.item_type, 'Item type'),
+    )
+    # The order id as a number instead of a select with every order
+    form_columns = ('order_id', 'item_type', 'item_id', 'quantity')
 
 def setup_admin(app):
-    app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
+    app.config.setdefault('ADMIN_STATEMENT_TIMEOUT_MS', int(os.getenv('ADMIN_STATEMENT_TIMEOUT_MS', 5000)))
+    app.config.setdefault('ADMIN_COUNT_CACHE_SECONDS', int(os.getenv('ADMIN_COUNT_CACHE_SECONDS', 60)))
+    app.secret_key = app.secret_key or os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
-    admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
+    admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3', index_view=IndexView())
 
     
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Change, db.session))
-    admin.add_view(ModelView(Order, db.session))
-    admin.add_view(ModelView(OrderItem, db.session))
-    admin.add_view(ModelView(FoodItem, db.session))
-    admin.add_view(ModelView(StoreItem, db.session))
-    admin.add_view(ModelView(AquaticItem, db.session))
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(ChangeView(Change, db.session))
+    admin.add_view(OrderView(Order, db.session))
+    admin.add_view(OrderItemView(OrderItem, db.session))
+    admin.add_view(CatalogModelView(FoodItem, db.session))
+    admin.add_view(CatalogModelView(StoreItem, db.session))
+    admin.add_view(CatalogModelView(AquaticItem, db.session))
 
     # You can duplicate that line to add mew models
     # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""
+Admission control for the API workers.
+
+Every request is put in a class before it runs:
+
+- 'write': anything that is not a GET, order entry first of all.
+- 'bulk': the list, export and report endpoints, the expensive reads.
+- 'read': the other GETs.
+
+A worker runs at most ADMISSION_MAX_IN_FLIGHT requests at once, and the last
+ADMISSION_RESERVED_FOR_WRITES of those slots are for writes only. Bulk reads
+also have their own cap, ADMISSION_BULK_LIMIT. A read that finds no free slot
+is turned away at once with a 503 and Retry-After, instead of queuing behind
+slow queries. A write waits up to ADMISSION_QUEUE_TIMEOUT_MS for a slot, and
+while writes are waiting no read is let in.
+
+The limits default to the requests a gunicorn worker runs at once (its
+threads, or its connections under gevent, see gunicorn.conf.py): a quarter
+of them for writes only and half for bulk reads. Higher limits would never
+be reached, the extra requests would wait in gunicorn's queue instead.
+
+The numbers in flight, the writes waiting and the requests turned away are in
+/metrics. Limits only matter with gthread or gevent workers, a sync worker
+never runs more than one request.
+"""
+import os
+import time
+import threading
+from flask import request, g, jsonify
+from metrics import registry
+
+CLASSES = ('write', 'read', 'bulk')
+
+BULK_ENDPOINTS = {
+    'api.get_users',
+    'api.get_orders',
+    'api.get_order_items',
+    'api.get_sales_report',
+    'api.get_archived_changes',
+    'api.export_food_items',
+    'api.export_store_items',
+    'api.export_aquatic_items',
+}
+
+# Not limited: the metrics must stay reachable under load, and the order
+# stream is long lived by design (it ends on its own, see events.py)
+EXEMPT_ENDPOINTS = {'api.get_metrics', 'api.stream_orders'}
+
+def default_limits():
+    """(max in flight, reserved for writes, bulk limit) for the gunicorn worker settings."""
+    if os.getenv('GUNICORN_WORKER_CLASS', 'gthread') == 'gevent':
+        concurrency = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 100))
+    else:
+        concurrency = int(os.getenv('GUNICORN_THREADS', 8))
+    return concurrency, concurrency // 4, max(1, concurrency // 2)
+
+class AdmissionController:
+    def __init__(self, app=None):
+        self._condition = threading.Condition()
+        self._in_flight = dict.fromkeys(CLASSES, 0)
+        self._waiting_writes = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        max_in_flight, reserved_for_writes, bulk_limit = default_limits()
+        # 0 turns admission control off
+        app.config.setdefault('ADMISSION_MAX_IN_FLIGHT', int(os.getenv('ADMISSION_MAX_IN_FLIGHT', max_in_flight)))
+        app.config.setdefault('ADMISSION_RESERVED_FOR_WRITES', int(os.getenv('ADMISSION_RESERVED_FOR_WRITES', reserved_for_writes)))
+        app.config.setdefault('ADMISSION_BULK_LIMIT', int(os.getenv('ADMISSION_BULK_LIMIT', bulk_limit)))
+        app.config.setdefault('ADMISSION_QUEUE_TIMEOUT_MS', int(os.getenv('ADMISSION_QUEUE_TIMEOUT_MS', 2000)))
+        app.config.setdefault('ADMISSION_RETRY_AFTER', int(os.getenv('ADMISSION_RETRY_AFTER', 1)))
+        self.config = app.config
+
+        registry.describe('admission_in_flight', 'gauge', 'Requests running, by admission class.')
+        registry.describe('admission_queued', 'gauge', 'Writes waiting for a free slot.')
+        registry.describe('admission_shed_total', 'counter', 'Requests turned away with a 503, by admission class.')
+        registry.describe('admission_queue_wait_seconds', 'histogram', 'Time writes waited for a free slot.')
+
+        # After metrics.init_app, so the 503s are counted like any other response
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def classify(self):
+        if request.endpoint in EXEMPT_ENDPOINTS or request.method == 'OPTIONS':
+            return None
+        if request.method not in ('GET', 'HEAD'):
+            return 'write'
+        return 'bulk' if request.endpoint in BULK_ENDPOINTS else 'read'
+
+    def _has_slot(self, request_class):
+        total = sum(self._in_flight.values())
+        if request_class == 'write':
+            return total < self.config['ADMISSION_MAX_IN_FLIGHT']
+        if self._waiting_writes or total >= self.config['ADMISSION_MAX_IN_FLIGHT'] - self.config['ADMISSION_RESERVED_FOR_WRITES']:
+            return False
+        return request_class != 'bulk' or self._in_flight['bulk'] < self.config['ADMISSION_BULK_LIMIT']
+
+    def _publish(self):
+        for request_class, count in self._in_flight.items():
+            registry.set('admission_in_flight', (('class', request_class),), count)
+        registry.set('admission_queued', (('class', 'write'),), self._waiting_writes)
+
+    def admit(self, request_class):
+        """Take a slot for request_class and return True, or return False when it is shed."""
+        with self._condition:
+            if not self._has_slot(request_class) and request_class == 'write':
+                started = time.perf_counter()
+                deadline = time.monotonic() + self.config['ADMISSION_QUEUE_TIMEOUT_MS'] / 1000
+                self._waiting_writes += 1
+                self._publish()
+                try:
+                    while not self._has_slot('write'):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                finally:
+                    self._waiting_writes -= 1
+                    registry.observe('admission_queue_wait_seconds', (), time.perf_counter() - started)
+            if not self._has_slot(request_class):
+                self._publish()
+                registry.inc('admission_shed_total', (('class', request_class),))
+                return False
+            self._in_flight[request_class] += 1
+            self._publish()
+            return True
+
+    def release(self, request_class):
+        with self._condition:
+            self._in_flight[request_class] -= 1
+            self._publish()
+            self._condition.notify_all()
+
+    def _before_request(self):
+        if not self.config['ADMISSION_MAX_IN_FLIGHT']:
+            return None
+        request_class = self.classify()
+        if request_class is None:
+            return None
+        if not self.admit(request_class):
+            response = jsonify({'message': 'The server is busy, retry shortly'})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(self.config['ADMISSION_RETRY_AFTER'])
+            return response
+        g.admission_class = request_class
+        return None
+
+    def _teardown_request(self, exception):
+        request_class = g.pop('admission_class', None)
+        if request_class is not None:
+            self.release(request_class)
+
+
+admission = AdmissionController()
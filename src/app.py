@@ -2,69 +2,309 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+import json
+from datetime import datetime, date, timedelta
+import click
+from flask import Flask, Blueprint, request, jsonify, g, url_for, current_app, Response, stream_with_context
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
-from models import db, User, Change, Order, FoodItem, StoreItem, AquaticItem, OrderItem
+from sqlalchemy import insert, select
+from utils import APIException, generate_sitemap, list_response, int_arg
+from cache import catalog_cache
+from admission import admission
+from bulk import import_catalog, export_catalog
+from search import search_items
+from catalog import catalog
+from changelog import change_writer
+from query_plans import check_query_plans
+from reports import GROUP_BY_COLUMNS, rollup_order, sales_report
+import archive
+import compression
+import replicas
+import auth
+import idempotency
+import events
+import metrics
+from events import record_order_events
+from idempotency import idempotent
+from patch import patch_values, patch_row
+from auth import requires_role, check_password, hash_password, issue_token, revoke_current_token, revoke_user_tokens
+from models import db, User, Change, Order, FoodItem, StoreItem, AquaticItem, OrderItem, ITEM_MODELS, resolve_items, reserve_stock, adjust_stock
 #from models import Person
 
-app = Flask(__name__)
-app.url_map.strict_slashes = False
-
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
+# All the endpoints live in this blueprint, create_app() mounts it
+api = Blueprint('api', __name__, cli_group=None)
+
+def env_flag(name, default='1'):
+    return os.getenv(name, default) == '1'
+
+def create_app(config=None):
+    """
+    Build the application. ENABLE_ADMIN, ENABLE_SWAGGER and ENABLE_MIGRATE
+    (environment variables or config keys) turn off the optional parts, whose
+    packages are then never imported. Flask-Migrate pulls in Alembic, so
+    wsgi.py leaves it out: migrations run through the flask CLI.
+    """
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is not None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
+    else:
+        app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Signs the login tokens (and the admin panel's session)
+    app.config['SECRET_KEY'] = os.getenv('FLASK_APP_KEY', 'sample key')
+    app.config['ENABLE_ADMIN'] = env_flag('ENABLE_ADMIN')
+    app.config['ENABLE_SWAGGER'] = env_flag('ENABLE_SWAGGER')
+    app.config['ENABLE_MIGRATE'] = env_flag('ENABLE_MIGRATE')
+
+    # Connection pool of each worker, sized to the requests it serves at once (see gunicorn.conf.py).
+    # Sessions are scoped to the app context, so every thread or greenlet gets its own session.
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': int(os.getenv('DB_POOL_SIZE', os.getenv('GUNICORN_THREADS', 8))),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 5)),
+            'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+            'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') == '1',
+            'poolclass': metrics.TimedQueuePool,
+        }
+    app.config.update(config or {})
+    replicas.configure(app)
+
+    db.init_app(app)
+    catalog_cache.init_app(app)
+    change_writer.init_app(app)
+    archive.init_app(app)
+    idempotency.init_app(app)
+    events.init_app(app)
+    metrics.init_app(app)
+    admission.init_app(app)
+    auth.init_app(app)
+    replicas.router.init_app(app)
+    # The browsers of other origins only let the clients read the headers listed here
+    CORS(app, expose_headers=[replicas.PIN_HEADER])
+    app.register_blueprint(api)
+    compression.init_app(app)
+
+    if app.config['ENABLE_MIGRATE']:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    if app.config['ENABLE_ADMIN']:
+        from admin import setup_admin
+        setup_admin(app)
+    if app.config['ENABLE_SWAGGER']:
+        app.add_url_rule('/spec', 'spec', get_spec)
+    return app
+
+def get_spec():
+    # flask_swagger is only imported the first time somebody asks for the spec
+    from flask_swagger import swagger
+    spec = swagger(current_app)
+    spec['info'] = {'title': 'Villa Sofia API', 'version': '1.0'}
+    return jsonify(spec)
+
+def reserve_order_items(items_data, released=()):
+    # Add up the quantities per item, less what the released order items give back, and
+    # reserve them in a fixed order, so two orders touching the same items always lock
+    # the rows in the same order and cannot deadlock.
+    wanted = {}
+    for item_data in items_data:
+        if not isinstance(item_data, dict):
+            raise APIException('Each item must be an object with item_type, item_id and quantity')
+        if item_data.get('item_type') not in ITEM_MODELS:
+            raise APIException("Unknown item_type '%s'" % item_data.get('item_type'),
+                               payload={'item_types': sorted(ITEM_MODELS)})
+        for name in ('item_id', 'quantity'):
+            value = item_data.get(name)
+            if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+                raise APIException("'%s' must be a positive integer" % name)
+        key = (item_data['item_type'], item_data['item_id'])
+        wanted[key] = wanted.get(key, 0) + item_data['quantity']
+    for order_item in released:
+        if order_item.item_type in ITEM_MODELS:
+            key = (order_item.item_type, order_item.item_id)
+            wanted[key] = wanted.get(key, 0) - order_item.quantity
+
+    for (item_type, item_id), quantity in sorted(wanted.items()):
+        model = ITEM_MODELS[item_type]
+        if quantity < 0:
+            # Nothing to give back to an item deleted from the catalog since
+            adjust_stock(model, item_id, -quantity)
+        elif quantity > 0 and not reserve_stock(model, item_id, quantity):
+            if db.session.get(model, item_id) is None:
+                raise APIException("%s %s does not exist" % (item_type, item_id), status_code=404)
+            raise APIException("Not enough stock for %s %s" % (item_type, item_id), status_code=409,
+                               payload={'item_type': item_type, 'item_id': item_id})
+
+    # The models whose cached catalog must be dropped once the reservation is committed
+    return {ITEM_MODELS[item_type] for item_type, item_id in wanted}
+
+def order_item_body():
+    # The item itself is checked by reserve_order_items
+    order_item_data = request.get_json(silent=True)
+    order_id = order_item_data.get('order_id') if isinstance(order_item_data, dict) else None
+    if not isinstance(order_id, int) or isinstance(order_id, bool):
+        raise APIException('Send a JSON object with order_id, item_type, item_id and quantity')
+    return order_item_data
+
+def update_stock(model, item, item_data):
+    """
+    Apply the stock change of a catalog PUT: quantity_change is added to the
+    stock, quantity is turned into the change from the stock read by this
+    request. Either way the sales made meanwhile are kept.
+    """
+    if 'quantity_change' in item_data:
+        change = item_data['quantity_change']
+        if not isinstance(change, int) or isinstance(change, bool):
+            raise APIException("'quantity_change' must be an integer")
+    elif item.quantity is None or item_data['quantity'] is None:
+        # Starting or stopping to track the stock
+        item.quantity = item_data['quantity']
+        return
+    else:
+        change = item_data['quantity'] - item.quantity
+    if change and not adjust_stock(model, item.id, change):
+        raise APIException('Not enough stock left to take %d away' % -change, status_code=409)
+
+def lock_open_order(order_id):
+    """
+    Lock the order row until the commit and refuse to change its items once it
+    is closed: they are already in the sales rollup. close_order locks the row
+    too, so an item can't slip in while the order is being closed.
+    """
+    closed_at = db.session.execute(
+        select(Order.closed_at).where(Order.id == order_id).with_for_update()
+    ).first()
+    if closed_at is None:
+        raise APIException('Order %s not found' % order_id, status_code=404)
+    if closed_at[0] is not None:
+        raise APIException('Order %s is closed, its items can not be changed' % order_id, status_code=409)
+
+@api.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail when one of the hot queries falls back to a full table scan."""
+    if not check_query_plans():
+        raise SystemExit(1)
+
+@api.cli.command('prune-order-events')
+@click.option('--hours', default=24, help='Keep the events of the last HOURS hours.')
+def prune_order_events_command(hours):
+    """Delete the old events of the /orders/stream feed."""
+    click.echo('Deleted %d order events' % events.prune_order_events(timedelta(hours=hours)))
+
+@api.cli.group('changes')
+def changes_cli():
+    """Archive and read back the change log."""
+
+@changes_cli.command('archive')
+@click.option('--days', type=int, help='Keep the changes of the last DAYS days (default CHANGE_RETENTION_DAYS).')
+@click.option('--batch-size', type=int, help='Rows moved per transaction (default CHANGE_ARCHIVE_BATCH_SIZE).')
+@click.option('--vacuum', is_flag=True, help='Give the space of the moved rows back to the database afterwards.')
+def archive_changes_command(days, batch_size, vacuum):
+    """Move the old changes to the monthly archive files."""
+    days = days if days is not None else current_app.config['CHANGE_RETENTION_DAYS']
+    batch_size = batch_size or current_app.config['CHANGE_ARCHIVE_BATCH_SIZE']
+    moved = archive.archive_changes(datetime.now() - timedelta(days=days), batch_size)
+    click.echo('Archived %d changes to %s' % (moved, current_app.config['CHANGE_ARCHIVE_DIR']))
+    if vacuum:
+        archive.compact_changes()
+
+@changes_cli.command('archived')
+@click.option('--from', 'date_from', type=click.DateTime(['%Y-%m-%d']), required=True)
+@click.option('--to', 'date_to', type=click.DateTime(['%Y-%m-%d']), required=True, help='Last day, included.')
+def archived_changes_command(date_from, date_to):
+    """Print the archived changes of a range of days as NDJSON."""
+    for change in archive.read_archived_changes(date_from, date_to + timedelta(days=1)):
+        click.echo(json.dumps(change))
+
+@api.cli.command('prune-idempotency-keys')
+def prune_idempotency_keys_command():
+    """Delete the expired Idempotency-Key responses."""
+    click.echo('Deleted %d idempotency keys' % idempotency.prune_idempotency_keys())
+
+@api.cli.command('hash-passwords')
+def hash_passwords_command():
+    """Hash the passwords still stored in plain text, without waiting for the users to log in."""
+    hashed = 0
+    for user in db.session.query(User):
+        if not auth.is_hashed(user.password):
+            user.password = hash_password(user.password)
+            hashed += 1
+    db.session.commit()
+    click.echo('Hashed %d passwords' % hashed)
 
 # Handle/serialize errors like a JSON object
-@app.errorhandler(APIException)
+@api.app_errorhandler(APIException)
 def handle_invalid_usage(error):
+    # Nothing flushed by the failed request may be committed later
+    db.session.rollback()
     return jsonify(error.to_dict()), error.status_code
 
 # generate sitemap with all your endpoints
-@app.route('/')
+@api.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    # The URL map doesn't change once the app is running, build the page only once
+    if 'sitemap' not in current_app.extensions:
+        current_app.extensions['sitemap'] = generate_sitemap(current_app)
+    return current_app.extensions['sitemap']
 
-@app.route('/users', methods=['GET'])
-def get_users():
-    # Get all users from the database.
-    users = User.query.all()
+@api.route('/metrics')
+def get_metrics():
+    return Response(metrics.metrics_text(), mimetype='text/plain; version=0.0.4')
 
-    # Return a JSON response with the users.
-    return jsonify([user.serialize() for user in users]), 200
+@api.route('/users', methods=['GET'])
+def get_users():
+    # Return a JSON response with the users, paginated or streamed on request.
+    return list_response(User.query, User)
 
-@app.route('/changes', methods=['POST'])
+@api.route('/changes', methods=['POST'])
+@idempotent
 def register_change():
     # Get the user name, change type, and change data from the request body.
     user_name = request.json['user_name']
     change_type = request.json['change_type']
     change_data = request.json['change_data']
 
+    change = {
+        'timestamp': datetime.now(),
+        'user_name': user_name,
+        'change_type': change_type,
+        'change_data': change_data,
+    }
+
+    # In buffered mode the change is written later together with others.
+    if change_writer.buffered:
+        if not change_writer.enqueue(change):
+            raise APIException('Too many changes are waiting to be written, retry shortly', status_code=503)
+        return jsonify({'message': 'Change accepted'}), 202
+
     # Insert a new row into the `changes` table.
-    change = Change(
-        timestamp=datetime.now(),
-        user_name=user_name,
-        change_type=change_type,
-        change_data=change_data,
-    )
-    db.session.add(change)
+    db.session.add(Change(**change))
     db.session.commit()
 
     # Return a success message.
     return jsonify({'message': 'Change registered successfully'}), 201
 
-@app.route('/users/<int:user_id>', methods=['GET'])
+@api.route('/changes/archive', methods=['GET'])
+@requires_role('admin')
+def get_archived_changes():
+    try:
+        date_from = date.fromisoformat(request.args['from'])
+        date_to = date.fromisoformat(request.args['to'])
+    except KeyError:
+        raise APIException("'from' and 'to' are required")
+    except ValueError:
+        raise APIException("'from' and 'to' must be dates like 2026-10-18")
+
+    # Both days included, streamed as NDJSON since a range can hold millions of changes
+    since = datetime.combine(date_from, datetime.min.time())
+    until = datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+    lines = (json.dumps(change) + '\n' for change in archive.read_archived_changes(since, until))
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+@api.route('/users/<int:user_id>', methods=['GET'])
 def get_user(user_id):
     # Get the user with the specified ID from the database.
     user = User.query.get(user_id)
@@ -72,7 +312,36 @@ def get_user(user_id):
     # Return a JSON response with the user.
     return jsonify(user.serialize()), 200
 
-@app.route('/users', methods=['POST'])
+@api.route('/login', methods=['POST'])
+def login():
+    # Get the credentials from the request body.
+    credentials = request.json
+    if not isinstance(credentials.get('user_name'), str) or not isinstance(credentials.get('password'), str):
+        raise APIException("'user_name' and 'password' are required")
+
+    # The only query of the session, every later request is checked from the token
+    user = db.session.query(User).filter_by(user_name=credentials['user_name']).one_or_none()
+    if not check_password(user, credentials['password']):
+        raise APIException('Wrong user name or password', status_code=401)
+    # Saves the password hashed again when it was stored in plain text or with an older method
+    db.session.commit()
+
+    return jsonify({
+        'token': issue_token(user),
+        'expires_in': current_app.config['AUTH_TOKEN_MAX_AGE'],
+        'user': user.serialize(),
+    }), 200
+
+@api.route('/logout', methods=['POST'])
+def logout():
+    if g.token is None:
+        raise APIException('Send the token to log out', status_code=401)
+    revoke_current_token()
+    return jsonify({'message': 'Logged out'}), 200
+
+@api.route('/users', methods=['POST'])
+@requires_role('admin')
+@idempotent
 def create_user():
     # Get the user data from the request body.
     user_data = request.json
@@ -83,7 +352,7 @@ def create_user():
         role=user_data['role'],
         date_of_birth=user_data['date_of_birth'],
         user_name=user_data['user_name'],
-        password=user_data['password'],
+        password=hash_password(user_data['password']),
     )
 
     # Add the user to the database.
@@ -93,7 +362,8 @@ def create_user():
     # Return a success message.
     return jsonify({'message': 'User created successfully'}), 201
 
-@app.route('/users/<int:user_id>', methods=['PUT'])
+@api.route('/users/<int:user_id>', methods=['PUT'])
+@requires_role('admin')
 def update_user(user_id):
     # Get the user data from the request body.
     user_data = request.json
@@ -101,20 +371,45 @@ def update_user(user_id):
     # Get the user with the specified ID from the database.
     user = User.query.get(user_id)
 
+    # The tokens carry the role, a new role or password needs a new login
+    password_changed = not check_password(user, user_data['password'])
+    signed_out = password_changed or user.role != user_data['role']
+
     # Update the user's data.
     user.name = user_data['name']
     user.role = user_data['role']
     user.date_of_birth = user_data['date_of_birth']
     user.user_name = user_data['user_name']
-    user.password = user_data['password']
+    if password_changed:
+        user.password = hash_password(user_data['password'])
 
     # Commit the changes to the database.
     db.session.commit()
+    if signed_out:
+        revoke_user_tokens(user.id)
 
     # Return a success message.
     return jsonify({'message': 'User updated successfully'}), 200
 
-@app.route('/users/<int:user_id>', methods=['DELETE'])
+@api.route('/users/<int:user_id>', methods=['PATCH'])
+@requires_role('admin')
+def patch_user(user_id):
+    # Only the fields sent are written, in one UPDATE that checks the version (see patch.py)
+    changes, version = patch_values(User, ('name', 'role', 'date_of_birth', 'user_name', 'password'))
+    if 'password' in changes:
+        changes['password'] = hash_password(changes['password'])
+    # Read before the UPDATE, which only succeeds when nobody changed the row since
+    role_changed = 'role' in changes and changes['role'] != db.session.scalar(select(User.role).where(User.id == user_id))
+    version = patch_row(User, user_id, changes, version)
+    db.session.commit()
+
+    # The tokens carry the role, a new role or password needs a new login
+    if 'password' in changes or role_changed:
+        revoke_user_tokens(user_id)
+    return jsonify({'message': 'User updated successfully', 'version': version}), 200
+
+@api.route('/users/<int:user_id>', methods=['DELETE'])
+@requires_role('admin')
 def delete_user(user_id):
     # Get the user with the specified ID from the database.
     user = User.query.get(user_id)
@@ -122,47 +417,109 @@ def delete_user(user_id):
     # Delete the user from the database.
     db.session.delete(user)
     db.session.commit()
+    revoke_user_tokens(user_id)
 
     # Return a success message.
     return jsonify({'message': 'User deleted successfully'}), 200
 
 
 
-@app.route('/orders', methods=['GET'])
+@api.route('/orders', methods=['GET'])
 def get_orders():
-    # Get all orders from the database.
-    orders = db.session.query(Order).all()
-
-    # Return a JSON response with the orders.
-    return jsonify([order.serialize() for order in orders]), 200
+    # Items of each batch of orders are loaded in one extra SELECT (selectin).
+    expand_items = request.args.get('expand') == 'items'
+
+    def serialize_orders(orders):
+        # With ?expand=items every item also carries its name and price, one query per item_type.
+        resolved = None
+        if expand_items:
+            resolved = resolve_items([item for order in orders for item in order.items])
+        return [order.serialize(resolved) for order in orders]
+
+    # Return a JSON response with the orders, paginated or streamed on request.
+    return list_response(db.session.query(Order), Order, serialize_orders)
+
+@api.route('/orders/stream', methods=['GET'])
+def stream_orders():
+    # A single-threaded server (gunicorn's sync worker) would serve nothing else while the stream is open
+    if not request.environ.get('wsgi.multithread'):
+        raise APIException('The order stream needs a gthread or gevent worker (GUNICORN_WORKER_CLASS)',
+                           status_code=503)
+
+    # Browsers send Last-Event-ID when they reconnect, other clients may use ?last_event_id=
+    last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    if last_id is not None:
+        try:
+            last_id = int(last_id)
+        except ValueError:
+            raise APIException('The last event id must be an integer')
+
+    return Response(
+        stream_with_context(events.event_stream(last_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
 
-@app.route('/orders/<int:order_id>', methods=['GET'])
+@api.route('/orders/<int:order_id>', methods=['GET'])
 def get_order(order_id):
     # Get the order with the specified ID from the database.
     order = db.session.query(Order).get(order_id)
 
+    resolved = None
+    if request.args.get('expand') == 'items':
+        resolved = resolve_items(order.items)
+
     # Return a JSON response with the order.
-    return jsonify(order.serialize()), 200
+    return jsonify(order.serialize(resolved)), 200
 
-@app.route('/orders', methods=['POST'])
+@api.route('/orders', methods=['POST'])
+@idempotent
 def create_order():
     # Get the order data from the request body.
     order_data = request.json
 
+    items_data = order_data.get('items', [])
+    if not isinstance(items_data, list):
+        raise APIException("'items' must be a list")
+
     # Create a new order object.
     order = Order(
         table_number=order_data['table_number'],
         number_of_people=order_data['number_of_people'],
     )
 
-    # Add the order to the database.
+    # Add the order to the database, flushing gives us its id without committing.
     db.session.add(order)
+    db.session.flush()
+
+    # Take the stock of every item, a shortage aborts the whole order.
+    reserved_models = reserve_order_items(items_data)
+
+    # Insert all the order items with a single multi-row INSERT ... RETURNING.
+    item_ids = []
+    if items_data:
+        item_ids = db.session.scalars(
+            insert(OrderItem).returning(OrderItem.id, sort_by_parameter_order=True),
+            [{
+                'order_id': order.id,
+                'item_type': item_data['item_type'],
+                'item_id': item_data['item_id'],
+                'quantity': item_data['quantity'],
+            } for item_data in items_data],
+        ).all()
+
+    # The order, its items, the stock changes and the event are written in one transaction.
+    record_order_events('created', 'order', [order.serialize()])
+    # Read before the commit expires the order, reloading it would also reload its items
+    order_id = order.id
     db.session.commit()
+    for model in reserved_models:
+        catalog_cache.invalidate(model, stock_only=True)
 
-    # Return a success message.
-    return jsonify({'message': 'Order created successfully'}), 201
+    # Return a success message with the new ids.
+    return jsonify({'message': 'Order created successfully', 'id': order_id, 'item_ids': item_ids}), 201
 
-@app.route('/orders/<int:order_id>', methods=['PUT'])
+@api.route('/orders/<int:order_id>', methods=['PUT'])
 def update_order(order_id):
     # Get the order data from the request body.
     order_data = request.json
@@ -174,28 +531,117 @@ def update_order(order_id):
     order.table_number = order_data['table_number']
     order.number_of_people = order_data['number_of_people']
 
-    # Commit the changes to the database.
+    # Flushed first, so the event carries the bumped version.
+    db.session.flush()
+    record_order_events('updated', 'order', [order.serialize()])
     db.session.commit()
 
     # Return a success message.
     return jsonify({'message': 'Order updated successfully'}), 200
 
-@app.route('/orders/<int:order_id>', methods=['DELETE'])
+@api.route('/orders/<int:order_id>', methods=['PATCH'])
+def patch_order(order_id):
+    # Only the fields sent are written, in one UPDATE that checks the version (see patch.py)
+    changes, version = patch_values(Order, ('table_number', 'number_of_people'))
+    version = patch_row(Order, order_id, changes, version)
+
+    # The event carries the changed fields only, the order isn't read back
+    record_order_events('patched', 'order', [dict(changes, id=order_id, version=version)])
+    db.session.commit()
+    return jsonify({'message': 'Order updated successfully', 'version': version}), 200
+
+@api.route('/orders/<int:order_id>', methods=['DELETE'])
 def delete_order(order_id):
     order = db.session.query(Order).get(order_id)
+    if order is None:
+        raise APIException('Order not found', status_code=404)
+    # The items of an open order go back to the stock, those of a closed one were sold
+    released_models = set()
+    if order.closed_at is None:
+        released_models = reserve_order_items([], released=order.items)
     db.session.delete(order)
+    record_order_events('deleted', 'order', [{'id': order_id}])
     db.session.commit()
+    for model in released_models:
+        catalog_cache.invalidate(model, stock_only=True)
     return jsonify({'message': 'Order deleted successfully'}), 200
 
+@api.route('/orders/<int:order_id>/close', methods=['POST'])
+@requires_role('admin', 'cashier')
+@idempotent
+def close_order(order_id):
+    order = db.session.get(Order, order_id, with_for_update=True)
+    if order is None:
+        raise APIException('Order not found', status_code=404)
+    if order.closed_at is not None:
+        raise APIException('Order is already closed', status_code=409)
+
+    # Closing the order and adding it to the daily sales totals happen in one transaction.
+    order.closed_at = datetime.now()
+    rollup_order(order)
+    record_order_events('closed', 'order', [order.serialize()])
+    db.session.commit()
+    return jsonify({'message': 'Order closed successfully'}), 200
+
+@api.route('/reports/sales', methods=['GET'])
+def get_sales_report():
+    group_by = request.args.get('group_by', 'day')
+    if group_by not in GROUP_BY_COLUMNS:
+        raise APIException("'group_by' must be one of: %s" % ', '.join(GROUP_BY_COLUMNS))
+    try:
+        date_from = date.fromisoformat(request.args['from'])
+        date_to = date.fromisoformat(request.args['to'])
+    except KeyError:
+        raise APIException("'from' and 'to' are required")
+    except ValueError:
+        raise APIException("'from' and 'to' must be dates like 2026-10-18")
+
+    return jsonify(sales_report(date_from, date_to, group_by)), 200
+
+@api.route('/search', methods=['GET'])
+def search():
+    # Type-ahead over the names of the three catalogs, best matches first.
+    query = request.args.get('q', '').strip()
+    if not query:
+        raise APIException("'q' is required")
+    limit = min(int_arg('limit') or 20, 100)
+    offset = int_arg('offset') or 0
+
+    page, has_more = search_items(query, limit, offset)
+    response = jsonify([{
+        'item_type': item_type,
+        'id': item_id,
+        'name': name,
+        'price': price,
+        'score': round(score, 3),
+    } for (item_type, item_id, name, price), score in page])
+    if has_more:
+        response.headers['Link'] = '<%s>; rel="next"' % url_for('api.search', q=query, limit=limit, offset=offset + limit)
+    return response
+
+@api.route('/catalog', methods=['GET'])
+def get_catalog():
+    # Food, store and aquatic items in one query, grouped by item_type.
+    if 'updated_since' not in request.args:
+        return catalog_cache.cached_response('catalog', list(ITEM_MODELS.values()),
+                                             lambda: jsonify(catalog()).get_data())
+    try:
+        updated_since = datetime.fromisoformat(request.args['updated_since'])
+    except ValueError:
+        raise APIException("'updated_since' must be a date and time like 2026-10-18T12:00:00")
+    return jsonify(catalog(updated_since)), 200
+
 # OrderItem routes
-@app.route('/orderitems', methods=['GET'])
+@api.route('/orderitems', methods=['GET'])
 def get_order_items():
-    order_items = db.session.query(OrderItem).all()
-    return jsonify([item.serialize() for item in order_items]), 200
+    return list_response(db.session.query(OrderItem), OrderItem)
 
-@app.route('/orderitems', methods=['POST'])
+@api.route('/orderitems', methods=['POST'])
+@idempotent
 def create_order_item():
-    order_item_data = request.json
+    order_item_data = order_item_body()
+    lock_open_order(order_item_data['order_id'])
+    reserved_models = reserve_order_items([order_item_data])
     order_item = OrderItem(
         order_id=order_item_data['order_id'],
         item_type=order_item_data['item_type'],
@@ -203,34 +649,70 @@ def create_order_item():
         quantity=order_item_data['quantity']
     )
     db.session.add(order_item)
+    db.session.flush()
+    record_order_events('created', 'order_item', [order_item.serialize()])
     db.session.commit()
+    for model in reserved_models:
+        catalog_cache.invalidate(model, stock_only=True)
     return jsonify({'message': 'Order item created successfully'}), 201
 
-@app.route('/orderitems/<int:order_item_id>', methods=['PUT'])
+@api.route('/orderitems/<int:order_item_id>', methods=['PUT'])
 def update_order_item(order_item_id):
-    order_item_data = request.json
+    order_item_data = order_item_body()
     order_item = db.session.query(OrderItem).get(order_item_id)
+    if order_item is None:
+        raise APIException('Order item not found', status_code=404)
+    for order_id in sorted({order_item.order_id, order_item_data['order_id']}):
+        lock_open_order(order_id)
+    # The stock of the old item and quantity is given back, the new one is reserved
+    reserved_models = reserve_order_items([order_item_data], released=[order_item])
     order_item.order_id = order_item_data['order_id']
     order_item.item_type = order_item_data['item_type']
     order_item.item_id = order_item_data['item_id']
     order_item.quantity = order_item_data['quantity']
+    # Flushed first, so the event carries the bumped version
+    db.session.flush()
+    record_order_events('updated', 'order_item', [order_item.serialize()])
     db.session.commit()
+    for model in reserved_models:
+        catalog_cache.invalidate(model, stock_only=True)
     return jsonify({'message': 'Order item updated successfully'}), 200
 
-@app.route('/orderitems/<int:order_item_id>', methods=['DELETE'])
+@api.route('/orderitems/<int:order_item_id>', methods=['PATCH'])
+def patch_order_item(order_item_id):
+    # The item and quantity change the stock reserved, PUT takes care of that
+    changes, version = patch_values(OrderItem, ('order_id',))
+    order_id = db.session.scalar(select(OrderItem.order_id).where(OrderItem.id == order_item_id))
+    for locked_id in sorted({order_id, changes.get('order_id', order_id)} - {None}):
+        lock_open_order(locked_id)
+    version = patch_row(OrderItem, order_item_id, changes, version)
+    record_order_events('patched', 'order_item', [dict(changes, id=order_item_id, version=version)])
+    db.session.commit()
+    return jsonify({'message': 'Order item updated successfully', 'version': version}), 200
+
+@api.route('/orderitems/<int:order_item_id>', methods=['DELETE'])
 def delete_order_item(order_item_id):
     order_item = db.session.query(OrderItem).get(order_item_id)
+    if order_item is None:
+        raise APIException('Order item not found', status_code=404)
+    lock_open_order(order_item.order_id)
+    released_models = reserve_order_items([], released=[order_item])
     db.session.delete(order_item)
+    record_order_events('deleted', 'order_item', [{'id': order_item_id, 'order_id': order_item.order_id}])
     db.session.commit()
+    for model in released_models:
+        catalog_cache.invalidate(model, stock_only=True)
     return jsonify({'message': 'Order item deleted successfully'}), 200
 
 # FoodItem routes
-@app.route('/fooditems', methods=['GET'])
+@api.route('/fooditems', methods=['GET'])
 def get_food_items():
-    food_items = db.session.query(FoodItem).all()
-    return jsonify([item.serialize() for item in food_items]), 200
+    # The full catalog is served from the cache, paginated or streamed requests go to the database.
+    return catalog_cache.list_response(FoodItem, lambda: list_response(db.session.query(FoodItem), FoodItem))
 
-@app.route('/fooditems', methods=['POST'])
+@api.route('/fooditems', methods=['POST'])
+@requires_role('admin')
+@idempotent
 def create_food_item():
     food_item_data = request.json
     food_item = FoodItem(
@@ -241,33 +723,64 @@ def create_food_item():
     )
     db.session.add(food_item)
     db.session.commit()
+    catalog_cache.invalidate(FoodItem)
     return jsonify({'message': 'FoodItem created successfully'}), 201
 
-@app.route('/fooditems/<int:food_item_id>', methods=['PUT'])
+@api.route('/fooditems/<int:food_item_id>', methods=['PUT'])
+@requires_role('admin')
 def update_food_item(food_item_id):
     food_item_data = request.json
     food_item = db.session.query(FoodItem).get(food_item_id)
+    if food_item is None:
+        raise APIException('FoodItem not found', status_code=404)
     food_item.name = food_item_data['name']
     food_item.price = food_item_data['price']
-    food_item.quantity = food_item_data['quantity']
+    update_stock(FoodItem, food_item, food_item_data)
     food_item.status = food_item_data['status']
     db.session.commit()
+    catalog_cache.invalidate(FoodItem)
     return jsonify({'message': 'FoodItem updated successfully'}), 200
 
-@app.route('/fooditems/<int:food_item_id>', methods=['DELETE'])
+@api.route('/fooditems/<int:food_item_id>', methods=['PATCH'])
+@requires_role('admin')
+def patch_food_item(food_item_id):
+    changes, version = patch_values(FoodItem, ('name', 'price', 'quantity', 'status'))
+    version = patch_row(FoodItem, food_item_id, changes, version)
+    db.session.commit()
+    # A change of the quantity alone leaves the names and prices cached by /search alone
+    catalog_cache.invalidate(FoodItem, stock_only=set(changes) == {'quantity'})
+    return jsonify({'message': 'FoodItem updated successfully', 'version': version}), 200
+
+@api.route('/fooditems/<int:food_item_id>', methods=['DELETE'])
+@requires_role('admin')
 def delete_food_item(food_item_id):
     food_item = db.session.query(FoodItem).get(food_item_id)
     db.session.delete(food_item)
     db.session.commit()
+    catalog_cache.invalidate(FoodItem)
     return jsonify({'message': 'FoodItem deleted successfully'}), 200
 
+@api.route('/fooditems/import', methods=['POST'])
+@requires_role('admin')
+def import_food_items():
+    # Bulk upsert by name from a CSV or NDJSON body, see bulk.py
+    response = import_catalog(FoodItem)
+    catalog_cache.invalidate(FoodItem)
+    return response
+
+@api.route('/fooditems/export', methods=['GET'])
+def export_food_items():
+    return export_catalog(FoodItem)
+
 # StoreItem routes
-@app.route('/storeitems', methods=['GET'])
+@api.route('/storeitems', methods=['GET'])
 def get_store_items():
-    store_items = db.session.query(StoreItem).all()
-    return jsonify([item.serialize() for item in store_items]), 200
+    # The full catalog is served from the cache, paginated or streamed requests go to the database.
+    return catalog_cache.list_response(StoreItem, lambda: list_response(db.session.query(StoreItem), StoreItem))
 
-@app.route('/storeitems', methods=['POST'])
+@api.route('/storeitems', methods=['POST'])
+@requires_role('admin')
+@idempotent
 def create_store_item():
     store_item_data = request.json
     store_item = StoreItem(
@@ -277,32 +790,63 @@ def create_store_item():
     )
     db.session.add(store_item)
     db.session.commit()
+    catalog_cache.invalidate(StoreItem)
     return jsonify({'message': 'Store item created successfully'}), 201
 
-@app.route('/storeitems/<int:store_item_id>', methods=['PUT'])
+@api.route('/storeitems/<int:store_item_id>', methods=['PUT'])
+@requires_role('admin')
 def update_store_item(store_item_id):
     store_item_data = request.json
     store_item = db.session.query(StoreItem).get(store_item_id)
+    if store_item is None:
+        raise APIException('StoreItem not found', status_code=404)
     store_item.name = store_item_data['name']
     store_item.price = store_item_data['price']
-    store_item.quantity = store_item_data['quantity']
+    update_stock(StoreItem, store_item, store_item_data)
     db.session.commit()
+    catalog_cache.invalidate(StoreItem)
     return jsonify({'message': 'Store item updated successfully'}), 200
 
-@app.route('/storeitems/<int:store_item_id>', methods=['DELETE'])
+@api.route('/storeitems/<int:store_item_id>', methods=['PATCH'])
+@requires_role('admin')
+def patch_store_item(store_item_id):
+    changes, version = patch_values(StoreItem, ('name', 'price', 'quantity'))
+    version = patch_row(StoreItem, store_item_id, changes, version)
+    db.session.commit()
+    # A change of the quantity alone leaves the names and prices cached by /search alone
+    catalog_cache.invalidate(StoreItem, stock_only=set(changes) == {'quantity'})
+    return jsonify({'message': 'Store item updated successfully', 'version': version}), 200
+
+@api.route('/storeitems/<int:store_item_id>', methods=['DELETE'])
+@requires_role('admin')
 def delete_store_item(store_item_id):
     store_item = db.session.query(StoreItem).get(store_item_id)
     db.session.delete(store_item)
     db.session.commit()
+    catalog_cache.invalidate(StoreItem)
     return jsonify({'message': 'Store item deleted successfully'}), 200
 
+@api.route('/storeitems/import', methods=['POST'])
+@requires_role('admin')
+def import_store_items():
+    # Bulk upsert by name from a CSV or NDJSON body, see bulk.py
+    response = import_catalog(StoreItem)
+    catalog_cache.invalidate(StoreItem)
+    return response
+
+@api.route('/storeitems/export', methods=['GET'])
+def export_store_items():
+    return export_catalog(StoreItem)
+
 # AquaticItem routes
-@app.route('/aquaticitems', methods=['GET'])
+@api.route('/aquaticitems', methods=['GET'])
 def get_aquatic_items():
-    aquatic_items = db.session.query(AquaticItem).all()
-    return jsonify([item.serialize() for item in aquatic_items]), 200
+    # The full catalog is served from the cache, paginated or streamed requests go to the database.
+    return catalog_cache.list_response(AquaticItem, lambda: list_response(db.session.query(AquaticItem), AquaticItem))
 
-@app.route('/aquaticitems', methods=['POST'])
+@api.route('/aquaticitems', methods=['POST'])
+@requires_role('admin')
+@idempotent
 def create_aquatic_item():
     aquatic_item_data = request.json
     aquatic_item = AquaticItem(
@@ -312,26 +856,55 @@ def create_aquatic_item():
     )
     db.session.add(aquatic_item)
     db.session.commit()
+    catalog_cache.invalidate(AquaticItem)
     return jsonify({'message': 'Aquatic item created successfully'}), 201
 
-@app.route('/aquaticitems/<int:aquatic_item_id>', methods=['PUT'])
+@api.route('/aquaticitems/<int:aquatic_item_id>', methods=['PUT'])
+@requires_role('admin')
 def update_aquatic_item(aquatic_item_id):
     aquatic_item_data = request.json
     aquatic_item = db.session.query(AquaticItem).get(aquatic_item_id)
+    if aquatic_item is None:
+        raise APIException('AquaticItem not found', status_code=404)
     aquatic_item.name = aquatic_item_data['name']
     aquatic_item.price = aquatic_item_data['price']
-    aquatic_item.quantity = aquatic_item_data['quantity']
+    update_stock(AquaticItem, aquatic_item, aquatic_item_data)
     db.session.commit()
+    catalog_cache.invalidate(AquaticItem)
     return jsonify({'message': 'Aquatic item updated successfully'}), 200
 
-@app.route('/aquaticitems/<int:aquatic_item_id>', methods=['DELETE'])
+@api.route('/aquaticitems/<int:aquatic_item_id>', methods=['PATCH'])
+@requires_role('admin')
+def patch_aquatic_item(aquatic_item_id):
+    changes, version = patch_values(AquaticItem, ('name', 'price', 'quantity'))
+    version = patch_row(AquaticItem, aquatic_item_id, changes, version)
+    db.session.commit()
+    # A change of the quantity alone leaves the names and prices cached by /search alone
+    catalog_cache.invalidate(AquaticItem, stock_only=set(changes) == {'quantity'})
+    return jsonify({'message': 'Aquatic item updated successfully', 'version': version}), 200
+
+@api.route('/aquaticitems/<int:aquatic_item_id>', methods=['DELETE'])
+@requires_role('admin')
 def delete_aquatic_item(aquatic_item_id):
     aquatic_item = db.session.query(AquaticItem).get(aquatic_item_id)
     db.session.delete(aquatic_item)
     db.session.commit()
+    catalog_cache.invalidate(AquaticItem)
     return jsonify({'message': 'Aquatic item deleted successfully'}), 200
 
+@api.route('/aquaticitems/import', methods=['POST'])
+@requires_role('admin')
+def import_aquatic_items():
+    # Bulk upsert by name from a CSV or NDJSON body, see bulk.py
+    response = import_catalog(AquaticItem)
+    catalog_cache.invalidate(AquaticItem)
+    return response
+
+@api.route('/aquaticitems/export', methods=['GET'])
+def export_aquatic_items():
+    return export_catalog(AquaticItem)
+
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
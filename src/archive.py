@@ -0,0 +1,105 @@
+"""
+Archive of the change log.
+
+`flask changes archive` moves the change rows older than CHANGE_RETENTION_DAYS
+out of the database, into gzip compressed NDJSON files with one file per month
+(changes-2026-07.ndjson.gz) in CHANGE_ARCHIVE_DIR. It works in batches of
+CHANGE_ARCHIVE_BATCH_SIZE rows: a batch is appended to the files and synced to
+disk, then deleted by primary key in its own short transaction, so the live
+table is never locked for long. A batch interrupted between the two steps is
+written again by the next run, and the readers skip the repeated ids, one
+month file at a time.
+
+/changes/archive and `flask changes archived` read the archives back for a
+time range, opening only the files of the months it covers.
+"""
+import os
+import gzip
+import json
+import fcntl
+import tempfile
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select, delete, text
+from models import db, Change
+
+def init_app(app):
+    default_directory = os.path.join(tempfile.gettempdir(), 'villasofia-archive')
+    app.config.setdefault('CHANGE_ARCHIVE_DIR', os.getenv('CHANGE_ARCHIVE_DIR', default_directory))
+    app.config.setdefault('CHANGE_RETENTION_DAYS', int(os.getenv('CHANGE_RETENTION_DAYS', 90)))
+    app.config.setdefault('CHANGE_ARCHIVE_BATCH_SIZE', int(os.getenv('CHANGE_ARCHIVE_BATCH_SIZE', 5000)))
+
+def archive_path(month):
+    return os.path.join(current_app.config['CHANGE_ARCHIVE_DIR'], 'changes-%s.ndjson.gz' % month)
+
+def _append(month, rows):
+    lines = b''.join(json.dumps({
+        'id': row.id,
+        'timestamp': row.timestamp.isoformat(),
+        'user_name': row.user_name,
+        'change_type': row.change_type,
+        'change_data': row.change_data,
+    }).encode() + b'\n' for row in rows)
+    # Every batch is a gzip member of its own, gzip reads the concatenation as one stream.
+    # The lock keeps two runs from interleaving their members.
+    with open(archive_path(month), 'ab') as raw:
+        fcntl.flock(raw, fcntl.LOCK_EX)
+        with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            f.write(lines)
+        raw.flush()
+        os.fsync(raw.fileno())
+
+def archive_changes(before, batch_size):
+    """Move the changes older than before to the archive files, return how many were moved."""
+    os.makedirs(current_app.config['CHANGE_ARCHIVE_DIR'], exist_ok=True)
+    archived = 0
+    while True:
+        rows = db.session.execute(
+            select(Change.id, Change.timestamp, Change.user_name, Change.change_type, Change.change_data)
+            .where(Change.timestamp < before)
+            .order_by(Change.timestamp, Change.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return archived
+
+        months = {}
+        for row in rows:
+            months.setdefault(row.timestamp.strftime('%Y-%m'), []).append(row)
+        for month, month_rows in months.items():
+            _append(month, month_rows)
+
+        # Only once the rows are safely on disk
+        db.session.execute(delete(Change).where(Change.id.in_([row.id for row in rows])))
+        db.session.commit()
+        archived += len(rows)
+
+def compact_changes():
+    # Plain VACUUM on PostgreSQL makes the space of the deleted rows reusable without
+    # blocking writes. On SQLite it rebuilds the whole file and locks it meanwhile.
+    statement = 'VACUUM (ANALYZE) change' if db.engine.dialect.name == 'postgresql' else 'VACUUM'
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text(statement))
+
+def _months(since, until):
+    year, month = since.year, since.month
+    while (year, month) < (until.year, until.month) or (
+            (year, month) == (until.year, until.month) and until > datetime(year, month, 1)):
+        yield '%04d-%02d' % (year, month)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+def read_archived_changes(since, until):
+    """Yield the archived changes with since <= timestamp < until, as dicts."""
+    for month in _months(since, until):
+        path = archive_path(month)
+        if not os.path.exists(path):
+            continue
+        # A change is only ever in the file of its month, so the ids are only remembered for one file
+        seen = set()
+        with gzip.open(path, 'rt') as f:
+            for line in f:
+                change = json.loads(line)
+                if change['id'] in seen or not since <= datetime.fromisoformat(change['timestamp']) < until:
+                    continue
+                seen.add(change['id'])
+                yield change
@@ -0,0 +1,237 @@
+"""
+Token authentication without a database query per request.
+
+POST /login checks the user name and password once and returns a token
+signed with FLASK_APP_KEY (itsdangerous) that carries the user id, the role,
+a token id and the time it was issued. Every other request is checked from
+the token alone: the signature and the age, then the revocation list. The
+tokens already verified are kept in an LRU of AUTH_TOKEN_CACHE_SIZE entries,
+so a token seen before costs a dict lookup instead of an HMAC.
+
+Passwords are hashed with werkzeug, PASSWORD_HASH_METHOD sets the algorithm
+and its cost. A password stored with another method, or still in plain text
+from before the hashing, is hashed again with the current one on the next
+successful login.
+
+The revocation list (tokens logged out, and users whose tokens were all
+revoked because their password, role or account changed) is a small JSON file
+in AUTH_REVOCATION_DIR that all the workers of the host share, like the
+catalog cache versions. A worker reads it again only when the file changed,
+and entries older than AUTH_TOKEN_MAX_AGE are dropped since their tokens have
+expired anyway.
+
+With AUTH_REQUIRED=0 (the default, so the current clients keep working)
+nothing is enforced, tokens are still issued and checked when sent. With
+AUTH_REQUIRED=1 the admin panel needs a token with the admin role too, from
+its login page (kept in a cookie) or in the Authorization header.
+"""
+import os
+import json
+import time
+import hmac
+import fcntl
+import secrets
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request, g, current_app
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from werkzeug.security import generate_password_hash, check_password_hash
+from utils import APIException
+
+HASH_METHODS = ('scrypt', 'pbkdf2')
+
+# No token needed to log in, to see the sitemap or to be scraped
+PUBLIC_ENDPOINTS = {'api.login', 'api.sitemap', 'api.get_metrics'}
+
+def init_app(app):
+    app.config.setdefault('AUTH_REQUIRED', os.getenv('AUTH_REQUIRED', '0') == '1')
+    app.config.setdefault('AUTH_TOKEN_MAX_AGE', int(os.getenv('AUTH_TOKEN_MAX_AGE', 12 * 3600)))
+    app.config.setdefault('AUTH_TOKEN_CACHE_SIZE', int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 1024)))
+    # werkzeug's default, 'pbkdf2:sha256:600000' is the alternative without scrypt
+    app.config.setdefault('PASSWORD_HASH_METHOD', os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1'))
+    default_directory = os.path.join(tempfile.gettempdir(), 'villasofia-auth')
+    app.config.setdefault('AUTH_REVOCATION_DIR', os.getenv('AUTH_REVOCATION_DIR', default_directory))
+    os.makedirs(app.config['AUTH_REVOCATION_DIR'], exist_ok=True)
+    if app.config['AUTH_REQUIRED'] and app.config['SECRET_KEY'] in (None, 'sample key'):
+        raise RuntimeError('Set FLASK_APP_KEY before turning AUTH_REQUIRED on, anybody can sign tokens with the sample key')
+
+    app.extensions['auth'] = TokenVerifier(app.config)
+    app.before_request(_authenticate)
+
+def hash_password(password):
+    return generate_password_hash(password, method=current_app.config['PASSWORD_HASH_METHOD'])
+
+def is_hashed(stored):
+    return stored.count('$') == 2 and stored.split(':', 1)[0].split('$', 1)[0] in HASH_METHODS
+
+
+# A hash of a random password per method: checked when the user name is unknown, so the
+# response takes as long as with a wrong password, and its prefix is the method written in full
+_reference_hashes = {}
+
+def _reference_hash():
+    method = current_app.config['PASSWORD_HASH_METHOD']
+    if method not in _reference_hashes:
+        _reference_hashes[method] = generate_password_hash(secrets.token_hex(8), method=method)
+    return _reference_hashes[method]
+
+def check_password(user, password):
+    """
+    Return True when password is the one of user, None being an unknown user.
+    A password stored in plain text or with another method is hashed again
+    (the caller commits).
+    """
+    if user is None:
+        check_password_hash(_reference_hash(), password)
+        return False
+    if not is_hashed(user.password):
+        matches = hmac.compare_digest(user.password.encode(), password.encode())
+    else:
+        matches = check_password_hash(user.password, password)
+    if matches and user.password.split('$', 1)[0] != _reference_hash().split('$', 1)[0]:
+        user.password = hash_password(password)
+    return matches
+
+class RevocationList:
+    def __init__(self, directory, max_age):
+        self.path = os.path.join(directory, 'revoked.json')
+        self.max_age = max_age
+        self._stamp = None
+        self._tokens = {}
+        self._users = {}
+
+    def _load(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._stamp, self._tokens, self._users = None, {}, {}
+            return
+        # The file is replaced on every change, so a new inode means new content
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+        if stamp != self._stamp:
+            with open(self.path) as f:
+                revoked = json.load(f)
+            self._tokens, self._users, self._stamp = revoked['tokens'], revoked['users'], stamp
+
+    def is_revoked(self, claims):
+        self._load()
+        return claims['jti'] in self._tokens or claims['iat'] <= self._users.get(str(claims['id']), 0)
+
+    def _update(self, section, key, value):
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path) as f:
+                    revoked = json.load(f)
+            except FileNotFoundError:
+                revoked = {'tokens': {}, 'users': {}}
+            revoked[section][key] = value
+            # Whatever is older than the tokens can be has no effect anymore
+            oldest = time.time() - self.max_age
+            revoked['tokens'] = {jti: at for jti, at in revoked['tokens'].items() if at > oldest}
+            revoked['users'] = {user_id: at for user_id, at in revoked['users'].items() if at > oldest}
+            tmp_path = '%s.%d' % (self.path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(revoked, f)
+            os.replace(tmp_path, self.path)
+
+    def revoke_token(self, claims):
+        self._update('tokens', claims['jti'], claims['iat'])
+
+    def revoke_user(self, user_id):
+        # Tokens issued up to now are revoked, the ones issued later are not
+        self._update('users', str(user_id), time.time())
+
+class TokenVerifier:
+    def __init__(self, config):
+        self.config = config
+        self.revoked = RevocationList(config['AUTH_REVOCATION_DIR'], config['AUTH_TOKEN_MAX_AGE'])
+        self._verified = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _serializer(self):
+        return URLSafeTimedSerializer(self.config['SECRET_KEY'], salt='villasofia-auth')
+
+    def issue(self, user):
+        # The signature only keeps whole seconds, iat tells a token issued right after a revocation apart
+        claims = {'id': user.id, 'role': user.role, 'jti': secrets.token_urlsafe(12), 'iat': time.time()}
+        return self._serializer().dumps(claims)
+
+    def verify(self, token):
+        """Return the claims of a valid token, or raise a 401 APIException."""
+        with self._lock:
+            claims = self._verified.get(token)
+            if claims is not None:
+                self._verified.move_to_end(token)
+        if claims is None:
+            try:
+                claims = self._serializer().loads(token, max_age=self.config['AUTH_TOKEN_MAX_AGE'])
+            except SignatureExpired:
+                raise APIException('The token has expired, log in again', status_code=401)
+            except BadSignature:
+                raise APIException('The token is not valid', status_code=401)
+            with self._lock:
+                self._verified[token] = claims
+                while len(self._verified) > self.config['AUTH_TOKEN_CACHE_SIZE']:
+                    self._verified.popitem(last=False)
+
+        # Checked on every request, the LRU only saves the signature check
+        if time.time() - claims['iat'] > self.config['AUTH_TOKEN_MAX_AGE']:
+            raise APIException('The token has expired, log in again', status_code=401)
+        if self.revoked.is_revoked(claims):
+            raise APIException('The token has been revoked, log in again', status_code=401)
+        return claims
+
+def issue_token(user):
+    return current_app.extensions['auth'].issue(user)
+
+def revoke_current_token():
+    revoke_token(g.token)
+
+def revoke_token(claims):
+    current_app.extensions['auth'].revoked.revoke_token(claims)
+
+def revoke_user_tokens(user_id):
+    current_app.extensions['auth'].revoked.revoke_user(user_id)
+
+def _bearer_token():
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' and token.strip() else None
+
+def _authenticate():
+    # The admin panel and /spec live outside the API blueprint
+    if request.blueprint != 'api' or request.endpoint in PUBLIC_ENDPOINTS or request.method == 'OPTIONS':
+        return None
+    g.token = None
+    token = _bearer_token()
+    if token is not None:
+        g.token = current_app.extensions['auth'].verify(token)
+    elif current_app.config['AUTH_REQUIRED']:
+        raise APIException('Log in and send the token as Authorization: Bearer <token>', status_code=401)
+    return None
+
+def token_claims(cookie=None):
+    """
+    The claims of the bearer token of the request, or of the token in the
+    cookie of that name when there is none, None without a valid token.
+    """
+    token = _bearer_token() or (request.cookies.get(cookie) if cookie else None)
+    if token is None:
+        return None
+    try:
+        return current_app.extensions['auth'].verify(token)
+    except APIException:
+        return None
+
+def requires_role(*roles):
+    """Only let tokens with one of roles in, when AUTH_REQUIRED is on."""
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            if current_app.config['AUTH_REQUIRED'] and g.token['role'] not in roles:
+                raise APIException('This needs the %s role' % ' or '.join(roles), status_code=403)
+            return handler(*args, **kwargs)
+        return wrapper
+    return decorator
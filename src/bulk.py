@@ -0,0 +1,151 @@
+"""
+Bulk import and export of the catalogs (food, store and aquatic items).
+
+An import reads the request body as it arrives, CSV with a header row or
+NDJSON, and writes it in batches of IMPORT_BATCH_SIZE rows. For each batch,
+one query finds the items that already exist by name (the oldest one when a
+name is repeated), then one bulk UPDATE and one bulk INSERT write the batch.
+Bad rows are skipped and reported with their line number, the rest of the
+file is committed at once at the end. Exports stream from a server-side
+cursor, so neither direction holds more than a batch in memory.
+"""
+import io
+import csv
+import json
+from datetime import datetime
+from flask import request, jsonify, Response, stream_with_context
+from sqlalchemy import select, insert, update, Integer, Float, String
+from models import db
+from utils import APIException, iter_batches, stream_response, serialize_all, fast_dumps
+
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+FORMATS = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson'}
+REQUIRED_COLUMNS = ('name', 'price')
+
+def import_columns(model):
+    # The id, the timestamps and the version are never taken from the file
+    return [column for column in model.__table__.columns if column.name not in ('id', 'created_at', 'updated_at', 'version')]
+
+def _number(column, value, kind):
+    try:
+        if isinstance(value, bool) or (kind is int and isinstance(value, float)):
+            raise ValueError
+        number = kind(value)
+    except (TypeError, ValueError):
+        raise ValueError("'%s' must be a number" % column.name)
+    if number < 0:
+        raise ValueError("'%s' must not be negative" % column.name)
+    return number
+
+def _convert(column, value):
+    if value is None or value == '':
+        if column.name in REQUIRED_COLUMNS:
+            raise ValueError("'%s' is required" % column.name)
+        return None
+    if isinstance(column.type, Integer):
+        return _number(column, value, int)
+    if isinstance(column.type, Float):
+        return _number(column, value, float)
+    value = str(value).strip()
+    if isinstance(column.type, String) and column.type.length and len(value) > column.type.length:
+        raise ValueError("'%s' is longer than %d characters" % (column.name, column.type.length))
+    return value
+
+def _clean(columns, record):
+    if not isinstance(record, dict):
+        raise ValueError('a row must be an object')
+    # A column missing from the file keeps its value on update
+    return {column.name: _convert(column, record.get(column.name))
+            for column in columns if column.name in record or column.name in REQUIRED_COLUMNS}
+
+def _records(stream, file_format):
+    # (line number, parsed record or None, error or None)
+    text = io.TextIOWrapper(io.BufferedReader(stream), encoding='utf-8', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record, None
+        return
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line), None
+        except ValueError:
+            yield number, None, 'not valid JSON'
+
+def _write_batch(model, rows, now):
+    # The last row of a name in the batch wins
+    by_name = {row['name']: row for row in rows}
+    existing = dict(db.session.execute(
+        select(model.name, model.id).where(model.name.in_(list(by_name))).order_by(model.id.desc())
+    ).all())
+    updates = [dict(row, id=existing[name], updated_at=now) for name, row in by_name.items() if name in existing]
+    inserts = [dict(row, created_at=now, updated_at=now) for name, row in by_name.items() if name not in existing]
+    if updates:
+        db.session.execute(update(model), updates)
+    if inserts:
+        db.session.execute(insert(model), inserts)
+    return len(inserts), len(updates)
+
+def import_catalog(model):
+    """Upsert the rows of the request body into model, return the JSON report."""
+    file_format = request.args.get('format') or FORMATS.get(request.mimetype)
+    if file_format not in FORMATS.values():
+        raise APIException("Send text/csv or application/x-ndjson, or pass ?format=csv|ndjson")
+
+    columns = import_columns(model)
+    now = datetime.now()
+    inserted = updated = error_count = 0
+    errors = []
+    batch = []
+    for line, record, error in _records(request.stream, file_format):
+        if error is None:
+            try:
+                batch.append(_clean(columns, record))
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'line': line, 'message': error})
+        if len(batch) == IMPORT_BATCH_SIZE:
+            counts = _write_batch(model, batch, now)
+            inserted, updated, batch = inserted + counts[0], updated + counts[1], []
+    if batch:
+        counts = _write_batch(model, batch, now)
+        inserted, updated = inserted + counts[0], updated + counts[1]
+    db.session.commit()
+
+    return jsonify({'inserted': inserted, 'updated': updated, 'error_count': error_count, 'errors': errors}), 200
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def export_catalog(model):
+    """Stream the whole catalog as NDJSON (the default) or CSV with ?format=csv."""
+    file_format = request.args.get('format', 'ndjson')
+    if file_format not in FORMATS.values():
+        raise APIException("'format' must be csv or ndjson")
+    if file_format == 'ndjson':
+        return stream_response(db.session.query(model).order_by(model.id), serialize_all, 'ndjson', fast_dumps)
+
+    columns = list(model.__table__.columns)
+    query = db.session.query(*columns).order_by(model.id)
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([column.name for column in columns])
+        for rows in iter_batches(query):
+            writer.writerows([_csv_value(value) for value in row] for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    response = Response(stream_with_context(generate()), mimetype='text/csv')
+    response.headers['Content-Disposition'] = 'attachment; filename=%s.csv' % model.__tablename__
+    return response
@@ -0,0 +1,114 @@
+"""
+In-process cache of the serialized catalogs (food, store and aquatic items).
+
+Every catalog has a version number kept in a small file that all the gunicorn
+workers of the host share. Writes bump the version after they commit, which
+makes every worker drop its copy on the next read. The version is also sent
+as the ETag so clients can revalidate without the database being touched.
+"""
+import os
+import fcntl
+import tempfile
+import threading
+import time
+from flask import request, current_app, jsonify
+from utils import serialize_all
+from replicas import primary
+
+class CatalogCache:
+    def __init__(self, app=None):
+        self.directory = None
+        self._entries = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        default_directory = os.path.join(tempfile.gettempdir(), 'villasofia-catalog')
+        app.config.setdefault('CATALOG_CACHE_DIR', os.getenv('CATALOG_CACHE_DIR', default_directory))
+        self.directory = app.config['CATALOG_CACHE_DIR']
+        os.makedirs(self.directory, exist_ok=True)
+        app.extensions['catalog_cache'] = self
+
+    def _path(self, model, kind):
+        return os.path.join(self.directory, '%s.%s' % (model.__tablename__, kind))
+
+    def _write(self, model, version, kind):
+        # Write to a temporary file and rename it so readers never see a partial number
+        path = self._path(model, kind)
+        tmp_path = '%s.%d' % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(str(version))
+        os.replace(tmp_path, path)
+
+    def _bump(self, model, kind, only_if_missing=False):
+        with open(os.path.join(self.directory, 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self._path(model, kind)) as f:
+                    version = int(f.read())
+                if only_if_missing:
+                    return version
+                version += 1
+            except FileNotFoundError:
+                # Start from the clock so a wiped cache directory never reuses an old ETag
+                version = int(time.time())
+            self._write(model, version, kind)
+            return version
+
+    def version(self, model, kind='version'):
+        """
+        The 'version' changes on every write. The 'details' version only when
+        something else than the stock changed, for the caches that leave it out.
+        """
+        try:
+            with open(self._path(model, kind)) as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return self._bump(model, kind, only_if_missing=True)
+
+    def invalidate(self, model, stock_only=False):
+        # Call it after the commit, so no worker can cache the old rows under the new version
+        self._bump(model, 'version')
+        if not stock_only:
+            self._bump(model, 'details')
+        with self._lock:
+            self._entries.pop(model.__tablename__, None)
+
+    def cached_response(self, key, models, build):
+        """
+        Return the body made by build() from the cache, or 304 when the client
+        already has it. The entry and the ETag follow the versions of models.
+        """
+        versions = [self.version(model) for model in models]
+        etag = '%s-%s' % (key, '-'.join(str(version) for version in versions))
+        # Weak comparison, compression.py makes the ETag of compressed responses weak
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None or entry[0] != versions:
+                # From the primary, a replica may not have the write behind the new version yet
+                with primary():
+                    entry = (versions, build())
+                with self._lock:
+                    self._entries[key] = entry
+            response = current_app.response_class(entry[1], mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def list_response(self, model, render):
+        """
+        Return the full catalog of model from the cache, or 304 when the client
+        already has the current version. Paginated and streamed requests carry
+        query arguments and are handed to render() untouched.
+        """
+        if request.args:
+            return render()
+        return self.cached_response(model.__tablename__, [model],
+                                    lambda: jsonify(serialize_all(model.query.order_by(model.id).all())).get_data())
+
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,66 @@
+"""
+The three catalogs in one response, for the start of the front end.
+
+A single UNION ALL query reads the food, store and aquatic items, and the
+rows are grouped by item_type, the same values OrderItem.item_type uses.
+With ?updated_since= only the items written since then are returned, and a
+client keeps its copy current by sending back the `as_of` of the previous
+response. Deleted items don't show up in such a refresh: `counts` holds the
+size of every catalog, a client whose counts differ loads everything again.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import select, literal, null, func, union_all
+from models import db, ITEM_MODELS
+
+# as_of is moved back by this much, so a write committed while the catalog was
+# being read is sent again on the next refresh instead of being missed
+SYNC_MARGIN = timedelta(seconds=30)
+
+def _columns(item_type, model):
+    return [
+        literal(item_type).label('item_type'),
+        model.id, model.name, model.price, model.quantity,
+        (model.status if hasattr(model, 'status') else null()).label('status'),
+        model.created_at, model.updated_at, model.version,
+    ]
+
+def catalog(updated_since=None):
+    started = datetime.now()
+    selects = []
+    for item_type, model in ITEM_MODELS.items():
+        statement = select(*_columns(item_type, model))
+        if updated_since is not None:
+            statement = statement.where(model.updated_at >= updated_since)
+        selects.append(statement)
+    query = union_all(*selects)
+    rows = db.session.execute(query.order_by(query.selected_columns.id)).all()
+
+    items = {item_type: [] for item_type in ITEM_MODELS}
+    for row in rows:
+        item = {
+            "id": row.id,
+            "name": row.name,
+            "price": row.price,
+            "quantity": row.quantity,
+            "created_at": row.created_at,
+            "updated_at": row.updated_at,
+            # What a PATCH of the item sends back
+            "version": row.version,
+        }
+        # Same keys as the serialize() of each model
+        if hasattr(ITEM_MODELS[row.item_type], 'status'):
+            item["status"] = row.status
+        items[row.item_type].append(item)
+
+    if updated_since is None:
+        counts = {item_type: len(rows) for item_type, rows in items.items()}
+    else:
+        counts = dict(db.session.execute(union_all(*(
+            select(literal(item_type), func.count()).select_from(model) for item_type, model in ITEM_MODELS.items()
+        ))).all())
+
+    return {
+        "items": items,
+        "counts": counts,
+        "as_of": (started - SYNC_MARGIN).isoformat(timespec='seconds'),
+    }
@@ -0,0 +1,100 @@
+"""
+Group-commit writer for the /changes audit log.
+
+With CHANGE_LOG_MODE=buffered the changes are queued inside the worker and
+written with one multi-row INSERT every CHANGE_LOG_BATCH_SIZE records or
+CHANGE_LOG_FLUSH_MS milliseconds, whichever comes first, plus a last flush
+when the worker exits. The default 'sync' mode commits every change in the
+request that registers it.
+
+A batch whose INSERT fails goes back to the front of the queue and is tried
+again on the next flush, the clients were already told it was accepted. The
+queue holds at most CHANGE_LOG_MAX_PENDING changes: when the database is
+down for long enough to fill it, /changes answers 503 instead of accepting
+changes that could not be kept. What still can't be written when the worker
+exits is logged in full, one JSON line per change.
+"""
+import os
+import json
+import atexit
+import logging
+import threading
+from sqlalchemy import insert
+from models import db, Change
+
+logger = logging.getLogger(__name__)
+
+class ChangeWriter:
+    def __init__(self, app=None):
+        self.app = None
+        self.buffered = False
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CHANGE_LOG_MODE', os.getenv('CHANGE_LOG_MODE', 'sync'))
+        app.config.setdefault('CHANGE_LOG_BATCH_SIZE', int(os.getenv('CHANGE_LOG_BATCH_SIZE', 100)))
+        app.config.setdefault('CHANGE_LOG_FLUSH_MS', int(os.getenv('CHANGE_LOG_FLUSH_MS', 200)))
+        app.config.setdefault('CHANGE_LOG_MAX_PENDING', int(os.getenv('CHANGE_LOG_MAX_PENDING', 10000)))
+        if app.config['CHANGE_LOG_MODE'] not in ('sync', 'buffered'):
+            raise ValueError("CHANGE_LOG_MODE must be 'sync' or 'buffered'")
+
+        self.app = app
+        self.buffered = app.config['CHANGE_LOG_MODE'] == 'buffered'
+        self.batch_size = app.config['CHANGE_LOG_BATCH_SIZE']
+        self.flush_interval = app.config['CHANGE_LOG_FLUSH_MS'] / 1000.0
+        self.max_pending = app.config['CHANGE_LOG_MAX_PENDING']
+        app.extensions['change_writer'] = self
+        if self.buffered:
+            atexit.register(self.flush, final=True)
+
+    def enqueue(self, change_data):
+        """Queue a change and return True, or return False when the queue is full."""
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                return False
+            self._pending.append(change_data)
+            full = len(self._pending) >= self.batch_size
+            # Started on first use so every gunicorn worker gets its own thread after the fork
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='change-writer', daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+        return True
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self, final=False):
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+        try:
+            with self.app.app_context():
+                try:
+                    db.session.execute(insert(Change), rows)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+        except Exception:
+            if final:
+                logger.exception('Could not write %d buffered changes, here they are:\n%s', len(rows),
+                                 '\n'.join(json.dumps(row, default=str) for row in rows))
+                return
+            logger.exception('Could not write %d buffered changes, trying again', len(rows))
+            # In front of the ones queued meanwhile, they keep their order
+            with self._lock:
+                self._pending[:0] = rows
+
+
+change_writer = ChangeWriter()
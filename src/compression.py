@@ -0,0 +1,132 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+JSON, NDJSON and CSV responses of COMPRESS_MIN_SIZE bytes or more are sent
+with brotli when the client accepts it and the brotli package is installed,
+else with gzip. Smaller bodies go out as they are, compressing them costs more
+than it saves.
+
+Streamed responses (?stream=, the exports) are compressed chunk by chunk as
+they are generated, flushed every STREAM_FLUSH_BYTES or so of input so the
+client gets them right away, never buffered whole. The event stream is left
+alone.
+
+A response with an ETag (the cached catalogs) always has the same body for
+the same ETag, so its compressed bytes are kept in an LRU of
+COMPRESS_CACHE_SIZE entries per (ETag, encoding), and the same menu isn't
+compressed again on every request. The ETag of a compressed response becomes
+weak, as the bytes differ from the uncompressed ones.
+"""
+import os
+import zlib
+import threading
+from collections import OrderedDict
+from flask import request, current_app
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+# Flushing every line of a stream would cost most of the compression
+STREAM_FLUSH_BYTES = 16 * 1024
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/csv', 'text/plain', 'text/html'}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def init_app(app):
+    app.config.setdefault('COMPRESS_MIN_SIZE', int(os.getenv('COMPRESS_MIN_SIZE', 1024)))
+    app.config.setdefault('COMPRESS_GZIP_LEVEL', int(os.getenv('COMPRESS_GZIP_LEVEL', 6)))
+    # 4 and 5 are the usual qualities for on-the-fly brotli, 11 is far too slow for it
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', int(os.getenv('COMPRESS_BROTLI_QUALITY', 4)))
+    app.config.setdefault('COMPRESS_CACHE_SIZE', int(os.getenv('COMPRESS_CACHE_SIZE', 32)))
+    # Registered last so it runs first, the request duration in /metrics includes it
+    app.after_request(compress_response)
+
+def choose_encoding():
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(encodings)
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=current_app.config['COMPRESS_BROTLI_QUALITY'])
+    compressor = zlib.compressobj(current_app.config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def compress_stream(chunks, encoding, level):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        process, sync, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, sync, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    pending = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = process(chunk)
+            pending += len(chunk)
+            if pending >= STREAM_FLUSH_BYTES:
+                data += sync()
+                pending = 0
+            if data:
+                yield data
+        yield finish()
+    finally:
+        # Closing the generator must close the streamed body too, stream_with_context relies on it
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def _cached_compress(etag, data, encoding):
+    key = (etag, encoding)
+    with _cache_lock:
+        body = _cache.get(key)
+        if body is not None:
+            _cache.move_to_end(key)
+            return body
+    body = compress(data, encoding)
+    with _cache_lock:
+        _cache[key] = body
+        while len(_cache) > current_app.config['COMPRESS_CACHE_SIZE']:
+            _cache.popitem(last=False)
+    return body
+
+def compress_response(response):
+    if response.status_code == 304:
+        # A 304 has no body and so no mimetype of its own, its ETag must still be the one of the 200
+        etag, weak = response.get_etag()
+        if etag is not None:
+            response.vary.add('Accept-Encoding')
+            if not weak and choose_encoding() is not None:
+                response.set_etag(etag, weak=True)
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES or response.direct_passthrough:
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code < 200 or response.status_code in (204, 304) or 'Content-Encoding' in response.headers:
+        return response
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # The size is rarely known (werkzeug's error pages have one), but the streamed responses are the large ones
+        if response.content_length is not None and response.content_length < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+        level = current_app.config['COMPRESS_BROTLI_QUALITY' if encoding == 'br' else 'COMPRESS_GZIP_LEVEL']
+        response.response = compress_stream(response.response, encoding, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_data(_cached_compress(etag, data, encoding))
+            response.set_etag(etag, weak=True)
+        else:
+            response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
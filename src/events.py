@@ -0,0 +1,105 @@
+"""
+Event feed of orders and order items for the kitchen display.
+
+The handlers write an OrderEvent row in the same transaction as the change,
+so an event exists exactly when its change is committed. /orders/stream polls
+that table by primary key and sends the new rows as server-sent events, which
+works the same whatever gunicorn worker did the write. The event id is the
+row id, so a reconnecting client resumes from its Last-Event-ID.
+
+The ids are handed out when the rows are inserted, but the transactions
+commit in their own order: id 10 can become visible after id 11. So the
+stream doesn't just go on from the highest id it sent. It scans again from
+the highest id inserted more than ORDER_STREAM_COMMIT_LAG_SECONDS ago, and
+leaves out the ids it already sent. A reconnecting client gets the same
+window again, so after a reconnect an event can come twice, with the same id.
+"""
+import os
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, insert, delete, func
+from models import db, OrderEvent
+from utils import compact_dumps
+
+KEEPALIVE_SECONDS = 15
+
+def init_app(app):
+    app.config.setdefault('ORDER_STREAM_POLL_MS', int(os.getenv('ORDER_STREAM_POLL_MS', 1000)))
+    # Streams end after this long and the browser reconnects, so a thread or greenlet is never held forever.
+    # They only run on gthread and gevent workers, whose heartbeat doesn't depend on the request (GUNICORN_TIMEOUT).
+    app.config.setdefault('ORDER_STREAM_MAX_SECONDS', int(os.getenv('ORDER_STREAM_MAX_SECONDS', 300)))
+    # How long a write may take between inserting its event and committing, a later commit is missed
+    app.config.setdefault('ORDER_STREAM_COMMIT_LAG_SECONDS', int(os.getenv('ORDER_STREAM_COMMIT_LAG_SECONDS', 10)))
+
+def record_order_events(action, entity, rows):
+    # rows are serialized records, each with its 'id'
+    if not rows:
+        return
+    now = datetime.now()
+    db.session.execute(insert(OrderEvent), [{
+        'created_at': now,
+        'action': action,
+        'entity': entity,
+        'entity_id': row['id'],
+        'data': compact_dumps(row),
+    } for row in rows])
+
+def format_event(event):
+    return 'id: %d\nevent: %s.%s\ndata: %s\n\n' % (event.id, event.entity, event.action, event.data)
+
+def settled_id(before):
+    """The highest event id inserted before the given time, every lower id is committed or never will be."""
+    return db.session.scalar(select(func.max(OrderEvent.id)).where(OrderEvent.created_at < before)) or 0
+
+def event_stream(last_id=None):
+    """The SSE of the events after last_id, or of the events to come for a new client (None)."""
+    poll_interval = current_app.config['ORDER_STREAM_POLL_MS'] / 1000.0
+    deadline = time.monotonic() + current_app.config['ORDER_STREAM_MAX_SECONDS']
+    next_keepalive = time.monotonic() + KEEPALIVE_SECONDS
+    commit_lag = timedelta(seconds=current_app.config['ORDER_STREAM_COMMIT_LAG_SECONDS'])
+
+    # The ids above floor already sent (or, for a new client, already there), with the time they were inserted
+    sent = {}
+    if last_id is None:
+        floor = settled_id(datetime.now() - commit_lag)
+        rows = db.session.execute(select(OrderEvent.id, OrderEvent.created_at).where(OrderEvent.id > floor))
+        sent = dict(rows.all())
+    else:
+        # Scan from the window behind last_id again, the events committed late may be in it
+        last = db.session.get(OrderEvent, last_id) if last_id else None
+        floor = last_id
+        if last is not None and last.created_at is not None:
+            floor = min(last_id, settled_id(last.created_at - commit_lag))
+
+    yield 'retry: %d\n\n' % current_app.config['ORDER_STREAM_POLL_MS']
+    while time.monotonic() < deadline:
+        query = select(OrderEvent).where(OrderEvent.id > floor)
+        if sent:
+            query = query.where(OrderEvent.id.notin_(sent))
+        events = db.session.execute(query.order_by(OrderEvent.id).limit(500)).scalars().all()
+
+        # The ids inserted before now - commit_lag are settled, and so are the lower ones
+        cutoff = datetime.now() - commit_lag
+        for event in events:
+            sent[event.id] = event.created_at
+        settled = [event_id for event_id, created_at in sent.items() if created_at is None or created_at < cutoff]
+        if settled:
+            floor = max(floor, max(settled))
+            sent = {event_id: created_at for event_id, created_at in sent.items() if event_id > floor}
+        # Give the connection back to the pool while we wait for the next poll
+        db.session.close()
+
+        if events:
+            yield ''.join(format_event(event) for event in events)
+        elif time.monotonic() >= next_keepalive:
+            yield ': keepalive\n\n'
+        else:
+            time.sleep(poll_interval)
+            continue
+        next_keepalive = time.monotonic() + KEEPALIVE_SECONDS
+
+def prune_order_events(max_age):
+    result = db.session.execute(delete(OrderEvent).where(OrderEvent.created_at < datetime.now() - max_age))
+    db.session.commit()
+    return result.rowcount
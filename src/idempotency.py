@@ -0,0 +1,94 @@
+"""
+Idempotency-Key support for the create handlers.
+
+Tablets on a flaky Wi-Fi retry their POSTs. When a request carries an
+Idempotency-Key header, the key is claimed with an IdempotencyKey row added
+to the same transaction as the write, so the key exists exactly when the
+write was committed. The response is stored right after, and a retry with
+the same key gets it back, with an Idempotent-Replayed header, without the
+handler running again. A retry arriving while the first request is still
+running gets a 409, a key reused for another request a 422.
+
+Keys expire after IDEMPOTENCY_TTL_HOURS, `flask prune-idempotency-keys`
+deletes the expired ones with a single indexed DELETE.
+"""
+import os
+import hashlib
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, current_app, jsonify
+from sqlalchemy import insert, update, delete
+from sqlalchemy.exc import IntegrityError
+from models import db, IdempotencyKey
+from utils import APIException
+
+MAX_KEY_LENGTH = 255
+
+def init_app(app):
+    app.config.setdefault('IDEMPOTENCY_TTL_HOURS', int(os.getenv('IDEMPOTENCY_TTL_HOURS', 24)))
+
+def _fingerprint():
+    digest = hashlib.sha256(('%s %s\n' % (request.method, request.full_path)).encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+def _claim(key, fingerprint):
+    """Insert the claim in the current transaction and return None, or return the row of an earlier request."""
+    now = datetime.now()
+    expires_at = now + timedelta(hours=current_app.config['IDEMPOTENCY_TTL_HOURS'])
+    for attempt in range(2):
+        try:
+            db.session.execute(insert(IdempotencyKey).values(key=key, fingerprint=fingerprint, expires_at=expires_at))
+            return None
+        except IntegrityError:
+            db.session.rollback()
+        existing = db.session.get(IdempotencyKey, key)
+        if existing is not None and existing.expires_at > now:
+            return existing
+        # Expired, or pruned in the meantime: the key can be used again
+        if existing is not None:
+            db.session.delete(existing)
+            db.session.commit()
+    raise APIException('Idempotency-Key is being used by another request', status_code=409)
+
+def _replay(stored, fingerprint):
+    if stored.fingerprint != fingerprint:
+        raise APIException('Idempotency-Key was already used for a different request', status_code=422)
+    if stored.status_code is None:
+        response = jsonify({'message': 'A request with this Idempotency-Key is still running'})
+        response.status_code = 409
+        response.headers['Retry-After'] = '1'
+        return response
+    response = current_app.response_class(stored.response, status=stored.status_code, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def idempotent(handler):
+    @wraps(handler)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return handler(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise APIException('Idempotency-Key must have 1 to %d characters' % MAX_KEY_LENGTH)
+
+        fingerprint = _fingerprint()
+        stored = _claim(key, fingerprint)
+        if stored is not None:
+            return _replay(stored, fingerprint)
+
+        # The handler commits the claim together with its write, or rolls both back on error
+        response = current_app.make_response(handler(*args, **kwargs))
+        db.session.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.key == key)
+            .values(status_code=response.status_code, response=response.get_data(as_text=True))
+        )
+        db.session.commit()
+        return response
+    return wrapper
+
+def prune_idempotency_keys():
+    result = db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < datetime.now()))
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,245 @@
+"""
+Request and database instrumentation.
+
+SQLAlchemy engine events count the queries of every request and add up
+their time. The totals go back in a Server-Timing header and into the
+per-route metrics served at /metrics in the Prometheus text format. Queries
+slower than SLOW_QUERY_MS are logged. Everything is plain counters behind a
+lock, cheap enough to leave on in production.
+
+Every worker keeps its own numbers. When METRICS_DIR is set, the workers
+also save them there (at most once a second), and /metrics adds up the
+files of all the workers of the host. The files of the workers that exited
+are added to exited.json, without their gauges, and removed: the totals
+never go down and the directory doesn't grow with every worker restart.
+"""
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from flask import g, request, has_app_context, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+slow_query_logger = logging.getLogger('slow_queries')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Request latency by route.'),
+    'http_requests_total': ('counter', 'Requests by route and status.'),
+    'db_queries_total': ('counter', 'SQL statements executed by route.'),
+    'db_query_duration_seconds_total': ('counter', 'Time spent in SQL statements by route.'),
+    'db_slow_queries_total': ('counter', 'SQL statements slower than SLOW_QUERY_MS.'),
+    'db_pool_checkout_wait_seconds': ('histogram', 'Time spent waiting for a pooled connection.'),
+}
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._saved_at = 0.0
+
+    def describe(self, name, kind, help_text):
+        METRICS[name] = (kind, help_text)
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, labels=(), value=0):
+        with self._lock:
+            self._values[(name, labels)] = value
+
+    def observe(self, name, labels=(), value=0.0):
+        key = (name, labels)
+        with self._lock:
+            buckets = self._values.get(key)
+            if buckets is None:
+                # one counter per bucket, then the sum and the count
+                buckets = self._values[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    buckets[index] += 1
+            buckets[-2] += value
+            buckets[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[name, list(labels), value[:] if isinstance(value, list) else value]
+                    for (name, labels), value in self._values.items()]
+
+    def save(self, directory, force=False):
+        # Throttled, the file is only read when /metrics is scraped
+        now = time.monotonic()
+        if not force and now - self._saved_at < 1.0:
+            return
+        self._saved_at = now
+        _write_snapshot(os.path.join(directory, '%d.json' % os.getpid()), self.snapshot())
+
+def _merge(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot:
+            key = (name, tuple(tuple(label) for label in labels))
+            # Counters and histograms add up across workers, and so do the gauges (in flight, queued)
+            if key not in merged:
+                merged[key] = value
+            elif isinstance(value, list):
+                merged[key] = [a + b for a, b in zip(merged[key], value)]
+            else:
+                merged[key] += value
+    return merged
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _write_snapshot(path, snapshot):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(path + '.tmp', path)
+
+def fold_exited_workers(directory):
+    """Add the numbers of the workers that exited to exited.json and remove their files."""
+    with open(os.path.join(directory, 'exited.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        paths = [os.path.join(directory, name) for name in os.listdir(directory)
+                 if name.endswith('.json') and name[:-5].isdigit() and not _alive(int(name[:-5]))]
+        if not paths:
+            return
+        exited_path = os.path.join(directory, 'exited.json')
+        snapshots = []
+        for path in [exited_path] + paths:
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        # A gauge is the state of a live worker, it means nothing once the worker is gone
+        merged = _merge(snapshots)
+        _write_snapshot(exited_path, [[name, [list(label) for label in labels], value]
+                                      for (name, labels), value in merged.items()
+                                      if METRICS.get(name, ('untyped',))[0] != 'gauge'])
+        for path in paths:
+            os.remove(path)
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in pairs)
+
+def render(snapshots):
+    merged = _merge(snapshots)
+    lines = []
+    for name in sorted({name for name, labels in merged}):
+        kind, help_text = METRICS.get(name, ('untyped', ''))
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for (metric, labels), value in sorted(merged.items()):
+            if metric != name:
+                continue
+            if kind == 'histogram':
+                for bound, count in zip(LATENCY_BUCKETS, value):
+                    lines.append('%s_bucket%s %d' % (name, _format_labels(labels, [('le', bound)]), count))
+                lines.append('%s_bucket%s %d' % (name, _format_labels(labels, [('le', '+Inf')]), value[-1]))
+                lines.append('%s_sum%s %.6f' % (name, _format_labels(labels), value[-2]))
+                lines.append('%s_count%s %d' % (name, _format_labels(labels), value[-1]))
+            else:
+                lines.append('%s%s %s' % (name, _format_labels(labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that records how long a checkout waited for a free connection
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            registry.observe('db_pool_checkout_wait_seconds', (), time.perf_counter() - started)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append((context, time.perf_counter()))
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    # A statement that raised never gets to after_cursor_execute, its start time goes here
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started and started[-1][0] is context.execution_context:
+        started.pop()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()[1]
+    if not has_app_context():
+        return
+    if 'sql_queries' in g:
+        g.sql_queries += 1
+        g.sql_seconds += elapsed
+    threshold = current_app.config.get('SLOW_QUERY_MS')
+    if threshold is not None and elapsed * 1000 >= threshold:
+        registry.inc('db_slow_queries_total')
+        slow_query_logger.warning('%.1f ms: %s', elapsed * 1000, ' '.join(statement.split())[:500])
+
+def _before_request():
+    g.request_started = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_seconds = 0.0
+
+def _after_request(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    labels = (('method', request.method), ('route', route))
+
+    registry.observe('http_request_duration_seconds', labels, elapsed)
+    registry.inc('http_requests_total', labels + (('status', response.status_code),))
+    registry.inc('db_queries_total', labels, g.sql_queries)
+    registry.inc('db_query_duration_seconds_total', labels, g.sql_seconds)
+
+    response.headers['Server-Timing'] = 'db;dur=%.2f;desc="%d queries", app;dur=%.2f' % (
+        g.sql_seconds * 1000, g.sql_queries, elapsed * 1000)
+
+    directory = current_app.config.get('METRICS_DIR')
+    if directory:
+        registry.save(directory)
+    return response
+
+def metrics_text():
+    directory = current_app.config.get('METRICS_DIR')
+    if not directory:
+        return render([registry.snapshot()])
+    registry.save(directory, force=True)
+    fold_exited_workers(directory)
+    snapshots = []
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return render(snapshots)
+
+def init_app(app):
+    app.config.setdefault('SLOW_QUERY_MS', float(os.getenv('SLOW_QUERY_MS', 200)))
+    app.config.setdefault('METRICS_DIR', os.getenv('METRICS_DIR'))
+    if app.config['METRICS_DIR']:
+        os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
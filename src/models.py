@@ -1,15 +1,31 @@
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import update, or_, literal_column
 from sqlalchemy.orm import relationship
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+# The session sends the reads of GET requests to a replica when there are some, see replicas.py
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def version_column():
+    # Bumped by every UPDATE of the row, ORM or not, PATCH requests send it back (see patch.py).
+    # Except the stock reservations, which set it explicitly: a sale must not turn the
+    # price PATCH of somebody who loaded the item a minute ago into a 409.
+    return db.Column(db.Integer, nullable=False, default=1, server_default='1',
+                     onupdate=literal_column('version') + 1)
 
 class User(db.Model):
+    # never returned by the API, not even with ?fields=
+    private_columns = ('password',)
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120))
     role = db.Column(db.String(120))
     date_of_birth = db.Column(db.Date)
     user_name = db.Column(db.String(120), unique=True)
-    password = db.Column(db.String(80), unique=False, nullable=False)
+    # werkzeug hash, see auth.py
+    password = db.Column(db.String(255), unique=False, nullable=False)
+    version = version_column()
 
     def __repr__(self):
         return '<User %r>' % self.username
@@ -21,62 +37,118 @@ class User(db.Model):
             "role": self.role,
             "date_of_birth": self.date_of_birth,
             "user_name": self.user_name,
+            "version": self.version,
             # do not serialize the password, its a security breach
         }
 
 class Change(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime)
-    user_name = db.Column(db.String(120))
+    timestamp = db.Column(db.DateTime, index=True)
+    user_name = db.Column(db.String(120), index=True)
     change_type = db.Column(db.String(120))
     change_data = db.Column(db.Text)
 
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    table_number = db.Column(db.Integer)
+    table_number = db.Column(db.Integer, index=True)
     number_of_people = db.Column(db.Integer)
-    created_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
     updated_at = db.Column(db.DateTime)
-    items = db.relationship('OrderItem', backref='order', lazy=True)  # new field
+    closed_at = db.Column(db.DateTime)
+    version = version_column()
+    items = db.relationship('OrderItem', backref='order', lazy='selectin')  # new field
 
     def __repr__(self):
         return '<Order %r>' % self.id
 
-    def serialize(self):
+    def serialize(self, resolved=None):
         return {
             "id": self.id,
             "table_number": self.table_number,
             "number_of_people": self.number_of_people,
             "created_at": self.created_at,
             "updated_at": self.updated_at,
-            "items": [item.serialize() for item in self.items]
+            "closed_at": self.closed_at,
+            "version": self.version,
+            "items": [item.serialize(resolved) for item in self.items]
         }
 
 
 class OrderItem(db.Model):  # new model
+    __table_args__ = (
+        db.Index('ix_order_item_item_type_item_id', 'item_type', 'item_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'))
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), index=True)
     item_id = db.Column(db.Integer)
     item_type = db.Column(db.String(50))
     quantity = db.Column(db.Integer)
+    version = version_column()
 
-    def serialize(self):
-        return {
+    def serialize(self, resolved=None):
+        data = {
             "id": self.id,
             "order_id": self.order_id,
             "item_id": self.item_id,
             "item_type": self.item_type,
             "quantity": self.quantity,
+            "version": self.version,
         }
+        # resolved comes from resolve_items(), only when the caller asked for item details
+        if resolved is not None:
+            data["item"] = resolved.get((self.item_type, self.item_id))
+        return data
+
+class OrderEvent(db.Model):
+    # Create, update and delete events of orders and order items, the id is the SSE event id
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, index=True)
+    action = db.Column(db.String(20))
+    entity = db.Column(db.String(50))
+    entity_id = db.Column(db.Integer)
+    data = db.Column(db.Text)
+
+class IdempotencyKey(db.Model):
+    # Response of a POST sent with an Idempotency-Key header, replayed when the tablet retries it
+    key = db.Column(db.String(255), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)  # NULL until the first request has finished
+    response = db.Column(db.Text)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class SalesRollup(db.Model):
+    # Daily sales totals, added to when an order is closed. The key columns are never NULL,
+    # NULLs never match in a unique constraint and ON CONFLICT would insert a row every time:
+    # an order without a table is stored with table -1, an item without a type or id with '' or 0.
+    __table_args__ = (
+        db.UniqueConstraint('day', 'item_type', 'item_id', 'table_number', name='uq_sales_rollup_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    item_type = db.Column(db.String(50), nullable=False, server_default='')
+    item_id = db.Column(db.Integer, nullable=False, server_default='0')
+    table_number = db.Column(db.Integer, nullable=False, server_default='-1')
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
 
 class FoodItem(db.Model):
+    # Trigram index behind /search on PostgreSQL (needs the pg_trgm extension)
+    __table_args__ = (
+        db.Index('ix_food_item_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120))
+    name = db.Column(db.String(120), index=True)
     price = db.Column(db.Float)
     quantity = db.Column(db.Integer)
     status = db.Column(db.String(120))
-    created_at = db.Column(db.DateTime)
-    updated_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    # Set on every write, stock updates included, /catalog?updated_since= filters on it
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now, index=True)
+    version = version_column()
 
     def __repr__(self):
         return '<FoodItem %r>' % self.id
@@ -90,16 +162,25 @@ class FoodItem(db.Model):
             "status": self.status,
             "created_at": self.created_at,
             "updated_at": self.updated_at,
+            "version": self.version,
         }
 
 
 class StoreItem(db.Model):
+    # Trigram index behind /search on PostgreSQL (needs the pg_trgm extension)
+    __table_args__ = (
+        db.Index('ix_store_item_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120))
+    name = db.Column(db.String(120), index=True)
     price = db.Column(db.Float)
     quantity = db.Column(db.Integer)
-    created_at = db.Column(db.DateTime)
-    updated_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    # Set on every write, stock updates included, /catalog?updated_since= filters on it
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now, index=True)
+    version = version_column()
 
     def __repr__(self):
         return '<StoreItem %r>' % self.id
@@ -112,16 +193,25 @@ class StoreItem(db.Model):
             "quantity": self.quantity,
             "created_at": self.created_at,
             "updated_at": self.updated_at,
+            "version": self.version,
         }
 
 
 class AquaticItem(db.Model):
+    # Trigram index behind /search on PostgreSQL (needs the pg_trgm extension)
+    __table_args__ = (
+        db.Index('ix_aquatic_item_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120))
+    name = db.Column(db.String(120), index=True)
     price = db.Column(db.Float)
     quantity = db.Column(db.Integer)
-    created_at = db.Column(db.DateTime)
-    updated_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    # Set on every write, stock updates included, /catalog?updated_since= filters on it
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now, index=True)
+    version = version_column()
 
     def __repr__(self):
         return '<AquaticItem %r>' % self.id
@@ -134,4 +224,45 @@ class AquaticItem(db.Model):
             "quantity": self.quantity,
             "created_at": self.created_at,
             "updated_at": self.updated_at,
+            "version": self.version,
         }
+
+
+# OrderItem.item_type values and the model each one points to
+ITEM_MODELS = {
+    'food': FoodItem,
+    'store': StoreItem,
+    'aquatic': AquaticItem,
+}
+
+def resolve_items(order_items):
+    # Group the referenced ids by item_type so every kind is fetched with a single query.
+    ids_by_type = {}
+    for order_item in order_items:
+        ids_by_type.setdefault(order_item.item_type, set()).add(order_item.item_id)
+
+    resolved = {}
+    for item_type, ids in ids_by_type.items():
+        model = ITEM_MODELS.get(item_type)
+        if model is None:
+            continue
+        rows = db.session.query(model.id, model.name, model.price).filter(model.id.in_(ids))
+        for item_id, name, price in rows:
+            resolved[(item_type, item_id)] = {"name": name, "price": price}
+    return resolved
+
+def adjust_stock(model, item_id, change):
+    # One conditional UPDATE relative to the stock at that moment: only this row is locked,
+    # and only for this statement, so two tablets can never both sell the last portions and
+    # an edit never overwrites the sales made meanwhile. NULL means stock is not tracked.
+    # The version is left as it is, see version_column.
+    result = db.session.execute(
+        update(model)
+        .where(model.id == item_id, or_(model.quantity.is_(None), model.quantity + change >= 0))
+        .values(quantity=model.quantity + change, version=model.version)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def reserve_stock(model, item_id, quantity):
+    return adjust_stock(model, item_id, -quantity)
@@ -0,0 +1,77 @@
+"""
+Partial updates (PATCH) with optimistic concurrency.
+
+The body holds only the fields to change, plus the version of the row the
+client last read. One UPDATE ... WHERE id = :id AND version = :version writes
+those fields and bumps the version (see version_column in models.py): the row
+is neither read nor locked beforehand. When the UPDATE matched no row, a
+second query tells a missing row (404) from a stale version (409, with the
+current version so the client can reload and try again).
+"""
+from datetime import date, datetime
+from flask import request
+from sqlalchemy import select, update, Integer, Float, String, Date, DateTime
+from models import db
+from utils import APIException
+
+def _convert(column, value):
+    if value is None:
+        if not column.nullable:
+            raise APIException("'%s' can't be null" % column.name)
+        return None
+    kind = column.type
+    if isinstance(kind, Integer):
+        valid = isinstance(value, int) and not isinstance(value, bool)
+    elif isinstance(kind, Float):
+        valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+    elif isinstance(kind, (Date, DateTime)):
+        parse = datetime.fromisoformat if isinstance(kind, DateTime) else date.fromisoformat
+        try:
+            return parse(value)
+        except (TypeError, ValueError):
+            raise APIException("'%s' must be an ISO date like 2026-10-18" % column.name)
+    else:
+        valid = isinstance(value, str)
+        if valid and isinstance(kind, String) and kind.length and len(value) > kind.length:
+            raise APIException("'%s' is longer than %d characters" % (column.name, kind.length))
+    if not valid:
+        raise APIException("'%s' must be a %s" % (column.name, 'number' if isinstance(kind, (Integer, Float)) else 'string'))
+    return value
+
+def patch_values(model, fields):
+    """
+    Return (changes, version) from the request body, changes being the
+    converted values of the fields that were sent, only fields may be sent.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise APIException('Send a JSON object with the fields to change and the version')
+    version = data.pop('version', None)
+    if not isinstance(version, int) or isinstance(version, bool):
+        raise APIException("'version' is required, the version of the row you last read")
+    unknown = set(data) - set(fields)
+    if unknown:
+        raise APIException('These fields can not be changed: %s' % ', '.join(sorted(unknown)),
+                           payload={'fields': list(fields)})
+    if not data:
+        raise APIException('Send at least one field to change')
+    columns = model.__table__.columns
+    return {name: _convert(columns[name], value) for name, value in data.items()}, version
+
+def patch_row(model, row_id, changes, version):
+    """
+    Write changes to the row if it is still at version, and return the new
+    version. Nothing is committed, the caller adds its side effects first.
+    """
+    result = db.session.execute(
+        update(model).where(model.id == row_id, model.version == version).values(**changes)
+    )
+    if result.rowcount == 1:
+        # version_column adds one on every UPDATE
+        return version + 1
+
+    current = db.session.scalar(select(model.version).where(model.id == row_id))
+    if current is None:
+        raise APIException('%s %d not found' % (model.__name__, row_id), status_code=404)
+    raise APIException('%s %d was changed by someone else, reload it and try again' % (model.__name__, row_id),
+                       status_code=409, payload={'version': current})
@@ -0,0 +1,59 @@
+"""
+EXPLAIN checks for the queries on the hot paths of the API.
+
+`flask check-query-plans` prints the plan of each query and exits with an
+error when one of them would read a whole table, so a missing or dropped
+index shows up before it reaches production. It supports SQLite
+(EXPLAIN QUERY PLAN) and PostgreSQL (EXPLAIN with sequential scans disabled,
+so small test tables don't hide a missing index).
+"""
+from datetime import datetime
+import click
+from sqlalchemy import select, text
+from models import db, Change, Order, OrderItem, FoodItem
+
+def hot_queries():
+    since = datetime(2026, 1, 1)
+    until = datetime(2026, 1, 2)
+    return {
+        'items of a batch of orders': select(OrderItem).where(OrderItem.order_id.in_([1, 2, 3])),
+        'order items of one catalog item': select(OrderItem).where(OrderItem.item_type == 'food', OrderItem.item_id == 1),
+        'order items page': select(OrderItem).where(OrderItem.id > 100).order_by(OrderItem.id).limit(100),
+        'catalog items by id': select(FoodItem.id, FoodItem.name, FoodItem.price).where(FoodItem.id.in_([1, 2, 3])),
+        'catalog items by name': select(FoodItem.id, FoodItem.name).where(FoodItem.name.in_(['arepa', 'lulo'])).order_by(FoodItem.id.desc()),
+        'catalog items updated since': select(FoodItem).where(FoodItem.updated_at >= since),
+        'orders of a table': select(Order).where(Order.table_number == 4),
+        'orders in a time range': select(Order).where(Order.created_at >= since, Order.created_at < until),
+        'changes in a time range': select(Change).where(Change.timestamp >= since, Change.timestamp < until).order_by(Change.timestamp),
+        'changes of a user': select(Change).where(Change.user_name == 'waiter'),
+    }
+
+def _seq_scans(plan):
+    if plan.get('Node Type') == 'Seq Scan':
+        yield 'Seq Scan on %s' % plan.get('Relation Name')
+    for child in plan.get('Plans', []):
+        yield from _seq_scans(child)
+
+def explain(statement):
+    """Return the plan lines of statement and the ones that are full table scans."""
+    dialect = db.engine.dialect
+    sql = str(statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    if dialect.name == 'sqlite':
+        plan = [row[-1] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+        return plan, [line for line in plan if line.startswith('SCAN ')]
+    if dialect.name == 'postgresql':
+        db.session.execute(text('SET LOCAL enable_seqscan = off'))
+        document = db.session.execute(text('EXPLAIN (FORMAT JSON) ' + sql)).scalar()
+        db.session.rollback()
+        root = document[0]['Plan']
+        return [root['Node Type']], list(_seq_scans(root))
+    raise click.ClickException('EXPLAIN checks are not supported on %s' % dialect.name)
+
+def check_query_plans():
+    failures = 0
+    for name, statement in hot_queries().items():
+        plan, full_scans = explain(statement)
+        status = 'FULL SCAN' if full_scans else 'ok'
+        click.echo('%-35s %-9s %s' % (name, status, ' | '.join(full_scans or plan)))
+        failures += bool(full_scans)
+    return failures == 0
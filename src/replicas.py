@@ -0,0 +1,135 @@
+"""
+Read replicas for the GET endpoints.
+
+DATABASE_REPLICA_URLS (comma separated) adds one engine per replica, as
+Flask-SQLAlchemy binds named replica_0, replica_1... Every GET or HEAD of the
+API picks one replica when it starts, by round-robin or by the fewest
+requests running on it (DB_REPLICA_POLICY), and all its reads go there, so
+they see one consistent replica. Flushes and INSERT/UPDATE/DELETE statements
+always go to the primary, as do the other methods, the admin panel, the CLI
+and the background threads.
+
+A client that just wrote reads its own writes: every successful write
+response pins the client's reads to the primary for DB_REPLICA_PIN_SECONDS,
+longer than the replicas usually lag behind. The pin is the time it ends,
+sent both as a cookie and as the X-DB-Primary-Until header. Browsers on the
+same site send the cookie back by themselves, the other clients (cross-origin
+ones included, CORS runs without credentials) echo the header. A pin further
+away than DB_REPLICA_PIN_SECONDS is ignored, so a client can't keep its reads
+on the primary for good.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+from itertools import count
+from flask import request, g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Insert, Update, Delete
+from metrics import registry
+
+PIN_COOKIE = 'db_primary_until'
+PIN_HEADER = 'X-DB-Primary-Until'
+POLICIES = ('round_robin', 'least_connections')
+
+def configure(app):
+    """Add the replica binds to the config, before db.init_app()."""
+    urls = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    app.config.setdefault('DATABASE_REPLICA_URLS', [url.replace('postgres://', 'postgresql://') for url in urls])
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    for number, url in enumerate(app.config['DATABASE_REPLICA_URLS']):
+        binds.setdefault('replica_%d' % number, url)
+
+class ReplicaRouter:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._turns = count()
+        self._in_flight = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('DB_REPLICA_POLICY', os.getenv('DB_REPLICA_POLICY', 'round_robin'))
+        app.config.setdefault('DB_REPLICA_PIN_SECONDS', int(os.getenv('DB_REPLICA_PIN_SECONDS', 5)))
+        if app.config['DB_REPLICA_POLICY'] not in POLICIES:
+            raise RuntimeError('DB_REPLICA_POLICY must be one of %s' % ', '.join(POLICIES))
+        self.config = app.config
+        self.keys = ['replica_%d' % number for number in range(len(app.config['DATABASE_REPLICA_URLS']))]
+        self._in_flight = dict.fromkeys(self.keys, 0)
+        if not self.keys:
+            return
+
+        registry.describe('db_replica_requests_total', 'counter', 'GET requests served by each database, by bind.')
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _pick(self):
+        with self._lock:
+            if self.config['DB_REPLICA_POLICY'] == 'least_connections':
+                # Ties go to the first one in the list
+                key = min(self.keys, key=self._in_flight.__getitem__)
+            else:
+                key = self.keys[next(self._turns) % len(self.keys)]
+            self._in_flight[key] += 1
+        return key
+
+    def _pinned(self):
+        now = time.time()
+        for pin in (request.headers.get(PIN_HEADER), request.cookies.get(PIN_COOKIE)):
+            try:
+                if pin is not None and now < float(pin) <= now + self.config['DB_REPLICA_PIN_SECONDS']:
+                    return True
+            except ValueError:
+                pass
+        return False
+
+    def _before_request(self):
+        if request.blueprint != 'api' or request.method not in ('GET', 'HEAD'):
+            return None
+        key = 'primary' if self._pinned() else self._pick()
+        registry.inc('db_replica_requests_total', (('bind', key),))
+        if key != 'primary':
+            g.db_replica = key
+        return None
+
+    def _after_request(self, response):
+        # The next reads of this client see what it just wrote
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            pin_seconds = self.config['DB_REPLICA_PIN_SECONDS']
+            pin = '%.3f' % (time.time() + pin_seconds)
+            response.set_cookie(PIN_COOKIE, pin, max_age=pin_seconds, httponly=True, samesite='Lax')
+            response.headers[PIN_HEADER] = pin
+        return response
+
+    def _teardown_request(self, exception):
+        key = g.pop('db_replica', None)
+        if key is not None:
+            with self._lock:
+                self._in_flight[key] -= 1
+
+
+router = ReplicaRouter()
+
+@contextmanager
+def primary():
+    """
+    Read from the primary inside the block. For what gets cached under a
+    version number that a write bumped, a lagging replica would cache the old
+    rows under the new version.
+    """
+    key = g.pop('db_replica', None) if has_request_context() else None
+    try:
+        yield
+    finally:
+        if key is not None:
+            g.db_replica = key
+
+class RoutingSession(Session):
+    """Session sending the reads of a request routed to a replica there, the rest to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() and 'db_replica' in g \
+                and not isinstance(clause, (Insert, Update, Delete)):
+            return self._db.engines[g.db_replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
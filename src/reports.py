@@ -0,0 +1,88 @@
+"""
+Sales reports.
+
+Closing an order adds its items to SalesRollup, one row per day, item and
+table, with the revenue priced at closing time. The reports only aggregate
+that small table, so a month-range report never re-scans the order history.
+"""
+from sqlalchemy import select, func, and_
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, OrderItem, FoodItem, StoreItem, AquaticItem, SalesRollup, resolve_items
+
+GROUP_BY_COLUMNS = {
+    'day': [SalesRollup.day],
+    'item': [SalesRollup.item_type, SalesRollup.item_id],
+    'item_type': [SalesRollup.item_type],
+    'table': [SalesRollup.table_number],
+}
+
+# Table 0 is a real table, so an order without one is rolled up under -1
+NO_TABLE = -1
+
+def _insert(table):
+    # ON CONFLICT upserts are dialect specific, both dialects spell them the same way
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+def rollup_order(order):
+    # Price every item of the order with one GROUP BY over the three item tables
+    price = func.coalesce(FoodItem.price, StoreItem.price, AquaticItem.price, 0)
+    totals = db.session.execute(
+        select(
+            OrderItem.item_type,
+            OrderItem.item_id,
+            func.sum(OrderItem.quantity).label('quantity'),
+            func.sum(OrderItem.quantity * price).label('revenue'),
+        )
+        .outerjoin(FoodItem, and_(OrderItem.item_type == 'food', FoodItem.id == OrderItem.item_id))
+        .outerjoin(StoreItem, and_(OrderItem.item_type == 'store', StoreItem.id == OrderItem.item_id))
+        .outerjoin(AquaticItem, and_(OrderItem.item_type == 'aquatic', AquaticItem.id == OrderItem.item_id))
+        .where(OrderItem.order_id == order.id)
+        .group_by(OrderItem.item_type, OrderItem.item_id)
+    ).all()
+    if not totals:
+        return
+
+    # The sentinels of SalesRollup instead of NULL, so the rows of the same key always meet
+    statement = _insert(SalesRollup).values([{
+        'day': order.closed_at.date(),
+        'item_type': row.item_type or '',
+        'item_id': row.item_id or 0,
+        'table_number': NO_TABLE if order.table_number is None else order.table_number,
+        'quantity': row.quantity or 0,
+        'revenue': row.revenue or 0,
+    } for row in totals])
+    # Concurrent closings of the same day add up atomically in the database
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['day', 'item_type', 'item_id', 'table_number'],
+        set_={
+            'quantity': SalesRollup.quantity + statement.excluded.quantity,
+            'revenue': SalesRollup.revenue + statement.excluded.revenue,
+        },
+    ))
+
+def sales_report(date_from, date_to, group_by):
+    columns = GROUP_BY_COLUMNS[group_by]
+    rows = db.session.execute(
+        select(*columns, func.sum(SalesRollup.quantity).label('quantity'), func.sum(SalesRollup.revenue).label('revenue'))
+        .where(SalesRollup.day >= date_from, SalesRollup.day <= date_to)
+        .group_by(*columns)
+        .order_by(*columns)
+    ).all()
+
+    resolved = resolve_items(rows) if group_by == 'item' else None
+    report = []
+    for row in rows:
+        data = row._asdict()
+        if 'table_number' in data:
+            table = data.pop('table_number')
+            data['table'] = None if table == NO_TABLE else table
+        if 'item_type' in data:
+            data['item_type'] = data['item_type'] or None
+        if 'item_id' in data:
+            data['item_id'] = data['item_id'] or None
+        if resolved is not None:
+            data['item'] = resolved.get((row.item_type, row.item_id))
+        report.append(data)
+    return report
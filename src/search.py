@@ -0,0 +1,158 @@
+"""
+Name search across the food, store and aquatic catalogs, for the type-ahead
+of the tablets.
+
+Results are ranked: the exact name first, then names starting with the
+query, then names with a word starting with it, then fuzzy matches (names
+sharing enough trigrams with the query, so typos still find the item).
+
+On PostgreSQL this is one UNION ALL query over GIN trigram indexes
+(pg_trgm). Elsewhere every worker keeps an in-memory index of the names: a
+sorted list of the words for the prefix matches and the trigram postings for
+the fuzzy ones. It is rebuilt when the catalog cache reports that names or
+prices changed, stock changes leave it alone.
+"""
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter, namedtuple
+from sqlalchemy import select, literal, func, case, union_all, or_
+from cache import catalog_cache
+from replicas import primary
+from models import db, ITEM_MODELS
+
+# Same default as pg_trgm.similarity_threshold
+SIMILARITY_THRESHOLD = 0.3
+EXACT, PREFIX, WORD_PREFIX = 3.0, 2.0, 1.0
+
+# items: (item_type, id, name, price) by position, keys: their normalized names,
+# sorted_keys/sorted_positions: the names in order, word_keys/word_positions: the
+# names from each later word on in order, postings: trigram -> positions, sizes: the
+# number of trigrams of each name
+_Index = namedtuple('_Index', 'items keys sorted_keys sorted_positions word_keys word_positions postings sizes')
+
+def normalize(text):
+    # Lowercase without accents, 'Patacón' is found with 'patacon'
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ' '.join(''.join(c for c in text if not unicodedata.combining(c)).split())
+
+def trigrams(text):
+    # Like pg_trgm: every word padded with two spaces in front and one behind
+    grams = set()
+    for word in text.split():
+        padded = '  %s ' % word
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class NameIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = None
+        # Replaced as a whole, so a search running during a rebuild sees one consistent index
+        self._index = _Index([], [], [], array('I'), [], array('I'), {}, array('H'))
+
+    def _current_versions(self):
+        return tuple(catalog_cache.version(model, 'details') for model in ITEM_MODELS.values())
+
+    def _rebuild(self, versions):
+        items, keys, words, postings, sizes = [], [], [], {}, array('H')
+        for item_type, model in ITEM_MODELS.items():
+            for item_id, name, price in db.session.execute(select(model.id, model.name, model.price)):
+                if not name:
+                    continue
+                position = len(items)
+                key = normalize(name)
+                items.append((item_type, item_id, name, price))
+                keys.append(key)
+                # The name from its second, third... word on, for the word prefix matches
+                start = key.find(' ')
+                while start != -1:
+                    words.append((key[start + 1:], position))
+                    start = key.find(' ', start + 1)
+                grams = trigrams(key)
+                sizes.append(len(grams))
+                for gram in grams:
+                    postings.setdefault(gram, array('I')).append(position)
+        by_name = sorted(range(len(keys)), key=keys.__getitem__)
+        words.sort()
+        self._index = _Index(items, keys, [keys[position] for position in by_name], array('I', by_name),
+                             [word for word, position in words], array('I', [position for word, position in words]),
+                             postings, sizes)
+        self._versions = versions
+
+    def _refresh(self):
+        versions = self._current_versions()
+        if versions != self._versions:
+            with self._lock:
+                if versions != self._versions:
+                    # From the primary, a replica may not have the write behind the new version yet
+                    with primary():
+                        self._rebuild(versions)
+
+    def search(self, query, limit, offset):
+        """Return up to limit (item, score) pairs after offset, and whether more follow."""
+        self._refresh()
+        index = self._index
+        wanted = offset + limit + 1
+
+        # Names starting with the query: a slice of the sorted names, already in order
+        low = bisect_left(index.sorted_keys, query)
+        high = bisect_left(index.sorted_keys, query + '\uffff', low)
+        ranked = [(position, EXACT if index.keys[position] == query else PREFIX)
+                  for position in index.sorted_positions[low:min(high, low + wanted)]]
+
+        # The other tiers rank below, they are only looked at when the page isn't full yet
+        if len(ranked) < wanted:
+            seen = set(index.sorted_positions[low:high])
+            low = bisect_left(index.word_keys, query)
+            high = bisect_left(index.word_keys, query + '\uffff', low)
+            matches = set(index.word_positions[low:high]) - seen
+            ranked += sorted(((position, WORD_PREFIX) for position in matches), key=lambda entry: index.keys[entry[0]])
+            seen |= matches
+
+        if len(ranked) < wanted:
+            grams = trigrams(query)
+            shared = Counter()
+            for gram in grams:
+                shared.update(index.postings.get(gram, ()))
+            fuzzy = []
+            for position, count in shared.items():
+                if position in seen:
+                    continue
+                similarity = count / (len(grams) + index.sizes[position] - count)
+                if similarity >= SIMILARITY_THRESHOLD:
+                    fuzzy.append((position, similarity))
+            ranked += sorted(fuzzy, key=lambda entry: (-entry[1], index.keys[entry[0]]))
+
+        page = [(index.items[position], score) for position, score in ranked[offset:offset + limit]]
+        return page, len(ranked) > offset + limit
+
+
+name_index = NameIndex()
+
+def _postgresql_search(query, limit, offset):
+    selects = []
+    for item_type, model in ITEM_MODELS.items():
+        score = case(
+            (func.lower(model.name) == query, EXACT),
+            (model.name.istartswith(query, autoescape=True), PREFIX),
+            (model.name.icontains(' ' + query, autoescape=True), WORD_PREFIX),
+            else_=0,
+        ) + func.similarity(model.name, query)
+        selects.append(
+            select(literal(item_type).label('item_type'), model.id, model.name, model.price, score.label('score'))
+            .where(or_(model.name.icontains(query, autoescape=True), model.name.op('%')(query)))
+        )
+    matches = union_all(*selects).subquery()
+    rows = db.session.execute(
+        select(matches).order_by(matches.c.score.desc(), matches.c.name).offset(offset).limit(limit + 1)
+    ).all()
+    page = [((row.item_type, row.id, row.name, row.price), row.score) for row in rows[:limit]]
+    return page, len(rows) > limit
+
+def search_items(query, limit, offset):
+    """Return a page of (item, score) pairs for query, item being (item_type, id, name, price)."""
+    if db.engine.dialect.name == 'postgresql':
+        return _postgresql_search(' '.join(query.lower().split()), limit, offset)
+    return name_index.search(normalize(query), limit, offset)
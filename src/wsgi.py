@@ -1,7 +1,10 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
 
-from app import app as application
+from app import create_app
+
+# The web workers don't need Flask-Migrate (and Alembic), migrations run through the flask CLI
+application = create_app({'ENABLE_MIGRATE': False})
 
 if __name__ == "__main__":
     application.run()
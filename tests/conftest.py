@@ -0,0 +1,72 @@
+import os
+import sys
+import pytest
+from sqlalchemy import event
+
+# The modules in src/ import each other by their plain names
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from app import create_app  # noqa: E402
+from models import db  # noqa: E402
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+def make_app(tmp_path, **config):
+    return create_app(dict({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % (tmp_path / 'test.db'),
+        'ENABLE_ADMIN': False,
+        'ENABLE_SWAGGER': False,
+        'ENABLE_MIGRATE': False,
+        'CATALOG_CACHE_DIR': str(tmp_path / 'catalog'),
+        'CHANGE_ARCHIVE_DIR': str(tmp_path / 'archive'),
+        'AUTH_REVOCATION_DIR': str(tmp_path / 'auth'),
+        'METRICS_DIR': None,
+    }, **config))
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(tmp_path)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def migrated_app(tmp_path):
+    """The app on a database built by the migrations instead of create_all()."""
+    from flask_migrate import upgrade
+    app = make_app(tmp_path, ENABLE_MIGRATE=True)
+    with app.app_context():
+        upgrade(directory=MIGRATIONS_DIR)
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def count_queries(app):
+    """count_queries(fn) runs fn and returns (number of SQL statements, fn's result)."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+
+    def count(fn):
+        del statements[:]
+        result = fn()
+        return len(statements), result
+
+    yield count
+    event.remove(db.engine, 'before_cursor_execute', record)
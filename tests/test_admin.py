@@ -0,0 +1,31 @@
+from datetime import datetime
+import pytest
+from flask import url_for
+from flask_admin.contrib.sqla import ModelView
+from conftest import make_app
+from models import db, User, Change
+from test_orders import add_orders
+
+
+@pytest.fixture
+def admin_app(tmp_path):
+    app = make_app(tmp_path, ENABLE_ADMIN=True)
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(name='Ana', user_name='ana', password='secret', role='admin'))
+        db.session.add(Change(timestamp=datetime.now(), user_name='ana', change_type='login', change_data='{}'))
+        add_orders(1)
+        yield app
+        db.session.remove()
+
+
+def test_every_create_and_edit_form_renders(admin_app):
+    client = admin_app.test_client()
+    views = [view for view in admin_app.extensions['admin'][0]._views if isinstance(view, ModelView)]
+    assert len(views) == 7
+    for view in views:
+        row_id = db.session.query(view.model.id).limit(1).scalar()
+        with admin_app.test_request_context():
+            urls = [url_for(view.endpoint + '.create_view'), url_for(view.endpoint + '.edit_view', id=row_id)]
+        for url in urls:
+            assert client.get(url).status_code == 200, url
@@ -0,0 +1,71 @@
+import threading
+import pytest
+from admission import admission, default_limits
+from metrics import registry
+
+
+@pytest.fixture
+def limited(app):
+    app.config.update(ADMISSION_MAX_IN_FLIGHT=4, ADMISSION_RESERVED_FOR_WRITES=1, ADMISSION_BULK_LIMIT=2,
+                      ADMISSION_QUEUE_TIMEOUT_MS=5000, ADMISSION_RETRY_AFTER=3)
+    taken = []
+
+    def take(request_class, count):
+        for _ in range(count):
+            assert admission.admit(request_class)
+            taken.append(request_class)
+
+    yield take
+    for request_class in taken:
+        admission.release(request_class)
+
+
+def shed(request_class):
+    return dict((tuple(map(tuple, labels)), value) for name, labels, value in registry.snapshot()
+                if name == 'admission_shed_total').get((('class', request_class),), 0)
+
+
+def test_reads_are_shed_and_writes_use_the_reserved_slots(client, limited):
+    limited('read', 3)
+    before = shed('read')
+    response = client.get('/catalog')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '3'
+    assert shed('read') == before + 1
+
+    response = client.post('/orders', json={'table_number': 1, 'number_of_people': 2})
+    assert response.status_code == 201
+
+
+def test_bulk_reads_have_their_own_cap(client, limited):
+    limited('bulk', 2)
+    assert client.get('/orders').status_code == 503
+    assert client.get('/catalog').status_code == 200
+
+
+def test_waiting_writes_go_before_reads(app, limited):
+    limited('read', 2)
+    for _ in range(2):
+        assert admission.admit('write')
+    admitted = []
+    writer = threading.Thread(target=lambda: admitted.append(admission.admit('write')))
+    writer.start()
+    while not admission._waiting_writes:
+        pass
+
+    # Two slots free up, enough for a read, but the read arriving meanwhile is refused
+    with admission._condition:
+        admission.release('write')
+        admission.release('write')
+        assert not admission.admit('read')
+    writer.join()
+    assert admitted == [True]
+    admission.release('write')
+
+
+def test_limits_follow_the_worker_concurrency(monkeypatch):
+    monkeypatch.setenv('GUNICORN_THREADS', '8')
+    assert default_limits() == (8, 2, 4)
+    monkeypatch.setenv('GUNICORN_WORKER_CLASS', 'gevent')
+    monkeypatch.setenv('GUNICORN_WORKER_CONNECTIONS', '100')
+    assert default_limits() == (100, 25, 50)
@@ -0,0 +1,36 @@
+import os
+import json
+from datetime import datetime
+from archive import archive_changes, read_archived_changes, _append
+from models import db, Change
+
+
+def add_changes():
+    for day in (datetime(2026, 6, 30, 23, 0), datetime(2026, 7, 1, 8, 0), datetime(2026, 7, 2, 9, 30)):
+        db.session.add(Change(timestamp=day, user_name='ana', change_type='price', change_data='{"price":6}'))
+    db.session.add(Change(timestamp=datetime(2026, 10, 1), user_name='leo', change_type='price', change_data='{}'))
+    db.session.commit()
+
+
+def test_archive_round_trip(client):
+    add_changes()
+    assert archive_changes(datetime(2026, 8, 1), batch_size=2) == 3
+    assert [change.user_name for change in db.session.query(Change)] == ['leo']
+
+    response = client.get('/changes/archive?from=2026-06-30&to=2026-07-01')
+    assert response.status_code == 200
+    changes = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [change['timestamp'] for change in changes] == ['2026-06-30T23:00:00', '2026-07-01T08:00:00']
+    assert changes[0]['change_data'] == '{"price":6}'
+
+
+def test_batches_written_twice_are_read_once(app):
+    add_changes()
+    rows = db.session.query(Change).filter(Change.timestamp < datetime(2026, 8, 1)).all()
+    # As if the run had stopped after writing the July batch and before deleting it
+    os.makedirs(app.config['CHANGE_ARCHIVE_DIR'])
+    _append('2026-07', [row for row in rows if row.timestamp.month == 7])
+    archive_changes(datetime(2026, 8, 1), batch_size=10)
+
+    changes = list(read_archived_changes(datetime(2026, 6, 1), datetime(2026, 8, 1)))
+    assert sorted(change['id'] for change in changes) == sorted(row.id for row in rows)
@@ -0,0 +1,100 @@
+import pytest
+from conftest import make_app
+from models import db, User, FoodItem
+
+FOOD = {'name': 'Arepa', 'price': 5, 'quantity': 10, 'status': 'active'}
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(tmp_path, AUTH_REQUIRED=True, SECRET_KEY='test secret', ENABLE_ADMIN=True)
+    with app.app_context():
+        db.create_all()
+        # Plain-text passwords, hashed on the first login
+        db.session.add(User(name='Ana', user_name='ana', password='ana-password', role='admin'))
+        db.session.add(User(name='Leo', user_name='leo', password='leo-password', role='waiter'))
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+def login(client, user_name):
+    response = client.post('/login', json={'user_name': user_name, 'password': user_name + '-password'})
+    assert response.status_code == 200
+    return {'Authorization': 'Bearer ' + response.json['token']}
+
+
+def test_login(client):
+    assert client.post('/login', json={'user_name': 'ana', 'password': 'wrong'}).status_code == 401
+    assert client.post('/login', json={'user_name': 'nobody', 'password': 'wrong'}).status_code == 401
+    response = client.post('/login', json={'user_name': 'ana', 'password': 'ana-password'})
+    assert response.status_code == 200
+    assert response.json['user']['role'] == 'admin'
+    assert 'password' not in response.json['user']
+    assert db.session.query(User.password).filter_by(user_name='ana').scalar().startswith('scrypt:')
+
+
+def test_requests_need_a_valid_token(client):
+    assert client.get('/orders').status_code == 401
+    assert client.get('/orders', headers={'Authorization': 'Bearer forged'}).status_code == 401
+    assert client.get('/orders', headers=login(client, 'leo')).status_code == 200
+
+
+def test_expired_token(app, client):
+    headers = login(client, 'leo')
+    app.config['AUTH_TOKEN_MAX_AGE'] = 0
+    response = client.get('/orders', headers=headers)
+    assert response.status_code == 401
+    assert 'expired' in response.json['message']
+
+
+def test_revoked_token(client):
+    headers = login(client, 'leo')
+    assert client.post('/logout', headers=headers).status_code == 200
+    response = client.get('/orders', headers=headers)
+    assert response.status_code == 401
+    assert 'revoked' in response.json['message']
+    # The other tokens of the user still work
+    assert client.get('/orders', headers=login(client, 'leo')).status_code == 200
+
+
+def test_roles(client):
+    waiter, admin = login(client, 'leo'), login(client, 'ana')
+    assert client.post('/fooditems', json=FOOD, headers=waiter).status_code == 403
+    assert client.post('/fooditems', json=FOOD, headers=admin).status_code == 201
+    food_id = db.session.query(FoodItem.id).scalar()
+    assert client.delete('/fooditems/%d' % food_id, headers=waiter).status_code == 403
+    assert client.post('/orders', json={'table_number': 1, 'number_of_people': 2}, headers=waiter).status_code == 201
+
+
+def test_admin_panel_login(client):
+    response = client.get('/admin/user/')
+    assert response.status_code == 302
+    assert '/admin/login/' in response.headers['Location']
+
+    assert client.get('/admin/login/').status_code == 200
+    response = client.post('/admin/login/', data={'user_name': 'leo', 'password': 'leo-password'})
+    assert response.status_code == 401
+    assert client.get('/admin/user/').status_code == 302
+
+    response = client.post('/admin/login/?next=/admin/user/', data={'user_name': 'ana', 'password': 'ana-password'})
+    assert response.status_code == 302
+    assert response.headers['Location'] == '/admin/user/'
+    assert client.get('/admin/user/').status_code == 200
+
+    client.post('/admin/logout/')
+    assert client.get('/admin/user/').status_code == 302
+
+
+def test_patching_the_same_role_keeps_the_tokens(client):
+    admin = login(client, 'ana')
+    waiter = login(client, 'leo')
+    leo = db.session.query(User).filter_by(user_name='leo').one()
+
+    response = client.patch('/users/%d' % leo.id, json={'version': leo.version, 'role': 'waiter'}, headers=admin)
+    assert response.status_code == 200
+    assert client.get('/orders', headers=waiter).status_code == 200
+
+    response = client.patch('/users/%d' % leo.id, json={'version': response.json['version'], 'role': 'cashier'}, headers=admin)
+    assert response.status_code == 200
+    assert client.get('/orders', headers=waiter).status_code == 401
@@ -0,0 +1,66 @@
+import csv
+import io
+import json
+import bulk
+from models import db, FoodItem
+
+
+def post_csv(client, text):
+    return client.post('/fooditems/import', data=text, content_type='text/csv')
+
+
+def test_csv_import_reports_the_bad_rows_and_keeps_the_rest(client):
+    response = post_csv(client, 'name,price,quantity\n'
+                                'Arepa,5,10\n'
+                                ',3,1\n'
+                                'Cachapa,cheap,2\n'
+                                'Empanada,2,-1\n'
+                                'Tequeno,1.5,20\n')
+    assert response.status_code == 200
+    assert response.json == {'inserted': 2, 'updated': 0, 'error_count': 3, 'errors': [
+        {'line': 3, 'message': "'name' is required"},
+        {'line': 4, 'message': "'price' must be a number"},
+        {'line': 5, 'message': "'quantity' must not be negative"},
+    ]}
+    assert sorted(db.session.scalars(db.select(FoodItem.name))) == ['Arepa', 'Tequeno']
+
+
+def test_ndjson_import_updates_by_name(client):
+    db.session.add(FoodItem(name='Arepa', price=5, quantity=10))
+    db.session.commit()
+
+    body = '{"name": "Arepa", "price": 6}\nnot json\n\n["Cachapa"]\n{"name": "Cachapa", "price": 4, "quantity": 3}\n'
+    response = client.post('/fooditems/import', data=body, content_type='application/x-ndjson')
+    assert response.json == {'inserted': 1, 'updated': 1, 'error_count': 2, 'errors': [
+        {'line': 2, 'message': 'not valid JSON'},
+        {'line': 4, 'message': 'a row must be an object'},
+    ]}
+    arepa = db.session.query(FoodItem).filter_by(name='Arepa').one()
+    # The quantity was not in the row, it keeps its value
+    assert (arepa.price, arepa.quantity) == (6, 10)
+
+
+def test_import_writes_in_batches_and_caps_the_reported_errors(client, monkeypatch):
+    monkeypatch.setattr(bulk, 'IMPORT_BATCH_SIZE', 3)
+    monkeypatch.setattr(bulk, 'MAX_REPORTED_ERRORS', 2)
+    rows = ''.join('Item %d,%d\n' % (number, number) for number in range(10)) + 'Bad,x\n' * 5
+    response = post_csv(client, 'name,price\n' + rows)
+    assert response.json['inserted'] == 10
+    assert response.json['error_count'] == 5
+    assert [error['line'] for error in response.json['errors']] == [12, 13]
+
+
+def test_import_needs_a_known_format(client):
+    response = client.post('/fooditems/import', data='name,price\n', content_type='text/plain')
+    assert response.status_code == 400
+    assert post_csv(client, 'name,price\n').json['inserted'] == 0
+
+
+def test_export_round_trips_through_import(client):
+    post_csv(client, 'name,price,quantity\nArepa,5,10\nTequeno,1.5,20\n')
+    exported = client.get('/fooditems/export?format=csv').get_data(as_text=True)
+    assert [row['name'] for row in csv.DictReader(io.StringIO(exported))] == ['Arepa', 'Tequeno']
+
+    lines = client.get('/fooditems/export').get_data(as_text=True).splitlines()
+    assert [json.loads(line)['price'] for line in lines] == [5, 1.5]
+    assert post_csv(client, exported).json == {'inserted': 0, 'updated': 2, 'error_count': 0, 'errors': []}
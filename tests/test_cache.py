@@ -0,0 +1,48 @@
+from cache import CatalogCache, catalog_cache
+from models import StoreItem
+
+WATER = {'name': 'Agua', 'price': 2, 'quantity': 50}
+
+
+def test_unchanged_catalogs_answer_304_without_a_query(client, count_queries):
+    assert client.post('/storeitems', json=WATER).status_code == 201
+    first = client.get('/storeitems')
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    count, response = count_queries(lambda: client.get('/storeitems', headers={'If-None-Match': first.headers['ETag']}))
+    assert response.status_code == 304
+    assert count == 0
+    # The body is cached too
+    count, response = count_queries(lambda: client.get('/storeitems'))
+    assert (count, response.json) == (0, first.json)
+
+
+def test_writes_invalidate_the_catalog(client):
+    client.post('/storeitems', json=WATER)
+    first = client.get('/storeitems')
+    water = first.json[0]
+
+    response = client.put('/storeitems/%d' % water['id'], json=dict(WATER, price=3))
+    assert response.status_code == 200
+    second = client.get('/storeitems', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert second.json[0]['price'] == 3
+
+    # Selling changes the stock shown
+    order = {'table_number': 1, 'number_of_people': 1, 'items': [{'item_type': 'store', 'item_id': water['id'], 'quantity': 2}]}
+    assert client.post('/orders', json=order).status_code == 201
+    third = client.get('/storeitems', headers={'If-None-Match': second.headers['ETag']})
+    assert third.status_code == 200
+    assert third.json[0]['quantity'] == 48
+
+
+def test_workers_share_the_versions(app):
+    # Another worker of the host has a cache of its own on the same directory
+    other_worker = CatalogCache()
+    other_worker.directory = app.config['CATALOG_CACHE_DIR']
+    before = other_worker.version(StoreItem)
+    catalog_cache.invalidate(StoreItem, stock_only=True)
+    assert other_worker.version(StoreItem) == before + 1
+    # The stock alone changed, the names and prices cached by /search stay valid
+    assert other_worker.version(StoreItem, 'details') == catalog_cache.version(StoreItem, 'details')
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+from models import db, FoodItem, StoreItem, AquaticItem, ITEM_MODELS
+
+
+def add_items():
+    db.session.add_all([FoodItem(name='Arepa', price=5, quantity=10, status='active'),
+                        StoreItem(name='Agua', price=2, quantity=50),
+                        AquaticItem(name='Mojarra', price=20, quantity=4)])
+    db.session.commit()
+
+
+def test_catalog_items_have_the_keys_of_serialize(client):
+    add_items()
+    response = client.get('/catalog')
+    assert response.status_code == 200
+    for item_type, model in ITEM_MODELS.items():
+        [item] = response.json['items'][item_type]
+        assert set(item) == set(db.session.query(model).one().serialize())
+    assert response.json['counts'] == {'food': 1, 'store': 1, 'aquatic': 1}
+
+
+def test_catalog_versions_allow_a_patch(client):
+    add_items()
+    [food] = client.get('/catalog').json['items']['food']
+    response = client.patch('/fooditems/%d' % food['id'], json={'version': food['version'], 'price': 6})
+    assert response.status_code == 200
+
+
+def test_updated_since_returns_the_changed_items(client):
+    add_items()
+    as_of = client.get('/catalog').json['as_of']
+    # Everything is newer than as_of, which is moved back by the sync margin
+    assert sum(len(items) for items in client.get('/catalog?updated_since=' + as_of).json['items'].values()) == 3
+
+    later = (datetime.now() + timedelta(minutes=1)).isoformat(timespec='seconds')
+    refresh = client.get('/catalog?updated_since=' + later).json
+    assert refresh['items'] == {'food': [], 'store': [], 'aquatic': []}
+    assert refresh['counts'] == {'food': 1, 'store': 1, 'aquatic': 1}
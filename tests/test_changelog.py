@@ -0,0 +1,52 @@
+from datetime import datetime
+import pytest
+from changelog import ChangeWriter, change_writer
+from models import db, Change
+
+
+def change(number):
+    return {'timestamp': datetime.now(), 'user_name': 'ana', 'change_type': 'price', 'change_data': str(number)}
+
+
+@pytest.fixture
+def writer(app):
+    # Flushed by the test only, the background thread sleeps
+    app.config.update(CHANGE_LOG_MODE='buffered', CHANGE_LOG_BATCH_SIZE=1000, CHANGE_LOG_FLUSH_MS=3600 * 1000,
+                      CHANGE_LOG_MAX_PENDING=3)
+    writer = ChangeWriter(app)
+    yield writer
+    writer._pending = []
+
+
+def test_buffered_changes_are_written_in_one_flush(writer):
+    for number in range(3):
+        assert writer.enqueue(change(number))
+    assert db.session.query(Change).count() == 0
+    writer.flush()
+    assert [row.change_data for row in db.session.query(Change).order_by(Change.id)] == ['0', '1', '2']
+
+
+def test_a_failed_flush_keeps_the_changes(writer):
+    writer.enqueue(change(0))
+    writer.enqueue(change(1))
+    Change.__table__.drop(db.engine)
+    writer.flush()
+    assert len(writer._pending) == 2
+
+    Change.__table__.create(db.engine)
+    writer.enqueue(change(2))
+    writer.flush()
+    assert [row.change_data for row in db.session.query(Change).order_by(Change.id)] == ['0', '1', '2']
+
+
+def test_a_full_queue_refuses_new_changes(app, client, writer):
+    for number in range(3):
+        assert writer.enqueue(change(number))
+    assert not writer.enqueue(change(3))
+
+    app.config['CHANGE_LOG_MODE'] = 'buffered'
+    change_writer.init_app(app)
+    change_writer.max_pending = 0
+    response = client.post('/changes', json={'user_name': 'ana', 'change_type': 'price', 'change_data': '{}'})
+    assert response.status_code == 503
+    change_writer.buffered = False
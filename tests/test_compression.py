@@ -0,0 +1,48 @@
+import gzip
+import json
+import pytest
+from models import db, FoodItem
+
+
+@pytest.fixture
+def menu(app):
+    db.session.add_all([FoodItem(name='Plato %d' % number, price=number, quantity=10, status='active')
+                        for number in range(200)])
+    db.session.commit()
+
+
+def test_large_responses_are_gzipped(client, menu):
+    response = client.get('/fooditems', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert len(json.loads(gzip.decompress(response.data))) == 200
+    assert response.headers['ETag'].startswith('W/')
+
+
+def test_brotli_is_preferred_when_installed(client, menu):
+    brotli = pytest.importorskip('brotli')
+    response = client.get('/fooditems', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert len(json.loads(brotli.decompress(response.data))) == 200
+
+
+def test_small_or_unasked_responses_are_left_alone(client, menu):
+    assert 'Content-Encoding' not in client.get('/fooditems').headers
+    response = client.get('/fooditems?limit=1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert len(response.json) == 1
+
+
+def test_streams_are_compressed_as_they_go(client, menu):
+    response = client.get('/fooditems?stream=ndjson', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    assert len(gzip.decompress(response.data).splitlines()) == 200
+
+
+def test_304_has_the_etag_of_the_compressed_200(client, menu):
+    first = client.get('/fooditems', headers={'Accept-Encoding': 'gzip'})
+    etag = first.headers['ETag']
+    response = client.get('/fooditems', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+from events import event_stream
+from models import db, OrderEvent
+
+
+def commit_event(event_id, created_at=None):
+    db.session.add(OrderEvent(id=event_id, created_at=created_at or datetime.now(), action='created',
+                              entity='order', entity_id=event_id, data='{"id":%d}' % event_id))
+    db.session.commit()
+
+
+def sent_ids(chunk):
+    return [int(line[4:]) for line in chunk.splitlines() if line.startswith('id: ')]
+
+
+def test_events_committed_out_of_id_order_are_sent(app):
+    app.config['ORDER_STREAM_POLL_MS'] = 1
+    commit_event(9)
+    stream = event_stream()
+    next(stream)  # retry:
+
+    # The transaction holding id 10 commits after the one holding id 11
+    commit_event(11)
+    assert sent_ids(next(stream)) == [11]
+    commit_event(10)
+    assert sent_ids(next(stream)) == [10]
+    commit_event(12)
+    assert sent_ids(next(stream)) == [12]
+
+
+def test_reconnecting_sends_the_late_events_again(app):
+    app.config['ORDER_STREAM_POLL_MS'] = 1
+    long_ago = datetime.now() - timedelta(minutes=5)
+    commit_event(1, long_ago)
+    commit_event(3)
+    commit_event(2)
+
+    # The client saw 3 before 2 was committed, the window behind 3 is scanned again
+    stream = event_stream(3)
+    next(stream)
+    assert sent_ids(next(stream)) == [2, 3]
+
+
+def test_the_stream_needs_a_threaded_worker(app, client):
+    app.config['ORDER_STREAM_MAX_SECONDS'] = 0
+    assert client.get('/orders/stream').status_code == 503
+    response = client.get('/orders/stream', environ_overrides={'wsgi.multithread': True})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert response.get_data(as_text=True).startswith('retry: ')
@@ -0,0 +1,49 @@
+import json
+import pytest
+import utils
+from models import db, User, FoodItem
+from test_orders import add_orders
+
+
+def test_fields_select_only_those_columns(client):
+    add_orders(3)
+    response = client.get('/fooditems?fields=name,price')
+    assert response.status_code == 200
+    assert response.json == [{'id': 1, 'name': 'Arepa', 'price': 5}]
+
+
+def test_fields_are_paginated_and_streamed_like_the_full_rows(client):
+    db.session.add_all([FoodItem(name='Item %d' % number, price=number, quantity=1) for number in range(5)])
+    db.session.commit()
+
+    page = client.get('/fooditems?fields=name&limit=2&after=1')
+    assert [row['id'] for row in page.json] == [2, 3]
+    stream = client.get('/fooditems?fields=price&stream=ndjson')
+    assert [json.loads(line) for line in stream.get_data(as_text=True).splitlines()] == \
+        [{'id': number + 1, 'price': number} for number in range(5)]
+
+
+def test_unknown_and_private_fields_are_rejected(client):
+    db.session.add(User(name='Ana', user_name='ana', password='secret', role='admin'))
+    db.session.commit()
+
+    assert client.get('/fooditems?fields=name,colour').status_code == 400
+    response = client.get('/users?fields=name,password')
+    assert response.status_code == 400
+    assert 'password' in response.json['message']
+    assert client.get('/users?fields=name').json == [{'id': 1, 'name': 'Ana'}]
+
+
+@pytest.mark.parametrize('orjson', [True, False])
+def test_fields_encode_the_same_with_and_without_orjson(client, monkeypatch, orjson):
+    if not orjson:
+        monkeypatch.setattr(utils, 'orjson', None)
+    elif utils.orjson is None:
+        pytest.skip('orjson is not installed')
+    add_orders(1)
+
+    response = client.get('/orders?fields=table_number,created_at')
+    assert response.status_code == 200
+    [row] = response.json
+    assert set(row) == {'id', 'table_number', 'created_at'}
+    assert row['created_at'] == client.get('/orders').json[0]['created_at']
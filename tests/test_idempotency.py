@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+from models import db, Order, IdempotencyKey
+from idempotency import prune_idempotency_keys
+
+ORDER = {'table_number': 4, 'number_of_people': 2}
+
+
+def post_order(client, key, body=ORDER):
+    return client.post('/orders', json=body, headers={'Idempotency-Key': key})
+
+
+def test_a_retry_replays_the_first_response(client):
+    first = post_order(client, 'tablet-1')
+    assert first.status_code == 201
+    assert 'Idempotent-Replayed' not in first.headers
+
+    retry = post_order(client, 'tablet-1')
+    assert (retry.status_code, retry.json) == (201, first.json)
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert db.session.query(Order).count() == 1
+
+
+def test_a_key_reused_for_another_request_is_422(client):
+    assert post_order(client, 'tablet-1').status_code == 201
+    response = post_order(client, 'tablet-1', dict(ORDER, table_number=5))
+    assert response.status_code == 422
+    assert db.session.query(Order).count() == 1
+
+
+def test_a_retry_while_the_first_request_runs_is_409(client):
+    # The claim of a request that has not answered yet has no response
+    assert post_order(client, 'tablet-1').status_code == 201
+    db.session.execute(db.update(IdempotencyKey).values(status_code=None, response=None))
+    db.session.commit()
+
+    response = post_order(client, 'tablet-1')
+    assert response.status_code == 409
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_a_failed_request_does_not_keep_the_key(client):
+    response = post_order(client, 'tablet-1', dict(ORDER, items='none'))
+    assert response.status_code == 400
+    assert db.session.query(IdempotencyKey).count() == 0
+    assert post_order(client, 'tablet-1').status_code == 201
+
+
+def test_expired_keys_can_be_used_again_and_are_pruned(client):
+    assert post_order(client, 'tablet-1').status_code == 201
+    assert post_order(client, 'tablet-2').status_code == 201
+    db.session.execute(db.update(IdempotencyKey).where(IdempotencyKey.key == 'tablet-1')
+                       .values(expires_at=datetime.now() - timedelta(seconds=1)))
+    db.session.commit()
+
+    response = post_order(client, 'tablet-1', dict(ORDER, table_number=5))
+    assert response.status_code == 201
+    assert 'Idempotent-Replayed' not in response.headers
+    db.session.execute(db.update(IdempotencyKey).values(expires_at=datetime.now() - timedelta(seconds=1)))
+    db.session.commit()
+    assert prune_idempotency_keys() == 2
+    assert db.session.query(IdempotencyKey).count() == 0
+
+
+def test_keys_must_not_be_too_long(client):
+    assert post_order(client, 'x' * 256).status_code == 400
+    assert client.post('/orders', json=ORDER).status_code == 201
@@ -0,0 +1,38 @@
+import json
+import subprocess
+import sys
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from metrics import fold_exited_workers, metrics_text
+from models import db
+
+
+def write_worker(directory, pid, requests, in_flight):
+    with open(directory / ('%d.json' % pid), 'w') as f:
+        json.dump([['http_requests_total', [['route', '/orders']], requests],
+                   ['admission_in_flight', [['class', 'exited']], in_flight]], f)
+
+
+def test_exited_workers_are_folded(app, tmp_path):
+    directory = tmp_path / 'metrics'
+    directory.mkdir()
+    app.config['METRICS_DIR'] = str(directory)
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    write_worker(directory, exited.pid, 5, 1)
+
+    fold_exited_workers(str(directory))
+    assert sorted(path.name for path in directory.glob('*.json')) == ['exited.json']
+
+    write_worker(directory, exited.pid, 2, 1)
+    text_format = metrics_text()
+    assert 'http_requests_total{route="/orders"} 7' in text_format
+    assert 'class="exited"' not in text_format
+
+
+def test_failed_statements_are_not_left_timed(app):
+    with db.engine.connect() as connection:
+        with pytest.raises(OperationalError):
+            connection.execute(text('SELECT * FROM no_such_table'))
+        assert connection.info['query_started'] == []
@@ -0,0 +1,139 @@
+import json
+from models import db, Order, OrderItem, OrderEvent, FoodItem, StoreItem, AquaticItem
+
+
+def add_orders(count):
+    items = [FoodItem(name='Arepa', price=5, quantity=100), StoreItem(name='Agua', price=2, quantity=100),
+             AquaticItem(name='Mojarra', price=20, quantity=100)]
+    db.session.add_all(items)
+    db.session.flush()
+    for number in range(count):
+        order = Order(table_number=number % 10, number_of_people=2)
+        order.items = [OrderItem(item_type=item_type, item_id=item.id, quantity=1)
+                       for item_type, item in zip(('food', 'store', 'aquatic'), items)]
+        db.session.add(order)
+    db.session.commit()
+
+
+def queries_for(count_queries, client, path, orders):
+    db.session.query(OrderItem).delete()
+    db.session.query(Order).delete()
+    add_orders(orders)
+    db.session.expire_all()
+    count, response = count_queries(lambda: client.get(path))
+    assert response.status_code == 200
+    assert len(response.json) == orders
+    return count
+
+
+def test_orders_query_count_does_not_grow_with_orders(client, count_queries):
+    small = queries_for(count_queries, client, '/orders?limit=1000', 10)
+    large = queries_for(count_queries, client, '/orders?limit=1000', 100)
+    assert small == large
+
+
+def test_expanded_orders_query_count_does_not_grow_with_orders(client, count_queries):
+    small = queries_for(count_queries, client, '/orders?limit=1000&expand=items', 10)
+    large = queries_for(count_queries, client, '/orders?limit=1000&expand=items', 100)
+    assert small == large
+
+
+def test_new_orders_get_created_at(client):
+    response = client.post('/orders', json={'table_number': 4, 'number_of_people': 2})
+    assert response.status_code == 201
+    assert db.session.query(Order).one().created_at is not None
+
+
+def test_items_of_closed_orders_can_not_change(client):
+    add_orders(1)
+    order = db.session.query(Order).one()
+    item = order.items[0]
+    assert client.post('/orders/%d/close' % order.id).status_code == 200
+
+    new_item = {'order_id': order.id, 'item_type': 'food', 'item_id': item.item_id, 'quantity': 1}
+    assert client.post('/orderitems', json=new_item).status_code == 409
+    assert client.put('/orderitems/%d' % item.id, json=new_item).status_code == 409
+    assert client.patch('/orderitems/%d' % item.id, json={'version': item.version, 'order_id': order.id}).status_code == 409
+    assert client.delete('/orderitems/%d' % item.id).status_code == 409
+    assert db.session.query(OrderItem).count() == 3
+
+
+def test_sales_do_not_conflict_with_catalog_patches(client):
+    add_orders(1)
+    food = db.session.query(FoodItem).one()
+    order = {'table_number': 1, 'number_of_people': 2, 'items': [{'item_type': 'food', 'item_id': food.id, 'quantity': 2}]}
+    assert client.post('/orders', json=order).status_code == 201
+
+    response = client.patch('/fooditems/%d' % food.id, json={'version': food.version, 'price': 6})
+    assert response.status_code == 200
+    db.session.expire_all()
+    assert (food.quantity, food.price) == (98, 6)
+
+
+def test_order_item_patch_leaves_stock_alone(client):
+    add_orders(1)
+    item = db.session.query(OrderItem).first()
+    response = client.patch('/orderitems/%d' % item.id, json={'version': item.version, 'quantity': 5})
+    assert response.status_code == 400
+
+
+def test_update_events_carry_the_new_version(client):
+    add_orders(1)
+    order = db.session.query(Order).one()
+    response = client.put('/orders/%d' % order.id, json={'table_number': 7, 'number_of_people': 3})
+    assert response.status_code == 200
+    event = db.session.query(OrderEvent).filter_by(action='updated').one()
+    assert json.loads(event.data)['version'] == 2
+
+
+def test_lists_are_compact(client):
+    add_orders(1)
+    for path in ('/orders', '/orderitems'):
+        data = client.get(path).data
+        assert b'": ' not in data and b', "' not in data
+
+
+def stock():
+    db.session.expire_all()
+    return db.session.query(FoodItem.quantity).scalar()
+
+
+def test_order_item_changes_move_the_stock(client):
+    add_orders(1)
+    item = db.session.query(OrderItem).filter_by(item_type='food').one()
+    assert stock() == 100
+
+    changed = {'order_id': item.order_id, 'item_type': 'food', 'item_id': item.item_id, 'quantity': 4}
+    assert client.put('/orderitems/%d' % item.id, json=changed).status_code == 200
+    assert stock() == 97
+    assert client.delete('/orderitems/%d' % item.id).status_code == 200
+    assert stock() == 101
+
+
+def test_catalog_put_keeps_the_sales_made_meanwhile(client):
+    add_orders(1)
+    food = db.session.query(FoodItem).one()
+    edit = {'name': 'Arepa', 'price': 5, 'quantity': 110, 'status': 'active'}
+    order = {'table_number': 1, 'number_of_people': 2, 'items': [{'item_type': 'food', 'item_id': food.id, 'quantity': 3}]}
+    assert client.post('/orders', json=order).status_code == 201
+
+    # quantity_change adds to the stock whatever the client read before
+    edit_change = dict(edit, quantity_change=10)
+    del edit_change['quantity']
+    assert client.put('/fooditems/%d' % food.id, json=edit_change).status_code == 200
+    assert stock() == 107
+    assert client.put('/fooditems/%d' % food.id, json=dict(edit, quantity_change=-200)).status_code == 409
+    assert stock() == 107
+
+
+def test_malformed_items_are_rejected(client):
+    add_orders(1)
+    order_id = db.session.query(Order.id).scalar()
+    for items in ([{'item_type': 'food', 'item_id': 1}], [{'item_type': 'food', 'quantity': 1}], ['x'],
+                  [{'item_type': 'pizza', 'item_id': 1, 'quantity': 1}], [{'item_type': 'food', 'item_id': '1', 'quantity': 1}]):
+        response = client.post('/orders', json={'table_number': 1, 'number_of_people': 2, 'items': items})
+        assert response.status_code == 400, items
+        item = items[0] if isinstance(items[0], dict) else {}
+        assert client.post('/orderitems', json=dict(item, order_id=order_id)).status_code == 400, items
+    assert client.post('/orderitems', json=['x']).status_code == 400
+    assert db.session.query(Order).count() == 1
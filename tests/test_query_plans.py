@@ -0,0 +1,8 @@
+import pytest
+from query_plans import hot_queries, explain
+
+
+@pytest.mark.parametrize('name', list(hot_queries()))
+def test_hot_query_uses_an_index(migrated_app, name):
+    plan, full_scans = explain(hot_queries()[name])
+    assert not full_scans, '%s: %s' % (name, ' | '.join(plan))
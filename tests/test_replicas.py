@@ -0,0 +1,33 @@
+import pytest
+from conftest import make_app
+from models import db
+
+
+@pytest.fixture
+def client(tmp_path):
+    # The replica is a database of its own that never receives the writes
+    app = make_app(tmp_path, DATABASE_REPLICA_URLS=['sqlite:///%s' % (tmp_path / 'replica.db')])
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(db.engines['replica_0'])
+        yield app.test_client()
+        db.session.remove()
+        # db keeps a metadata per bind it has seen, the next apps have no replica bind
+        db.metadatas.pop('replica_0')
+
+
+def test_writes_pin_the_reads_to_the_primary_with_a_header(client):
+    response = client.post('/orders', json={'table_number': 1, 'number_of_people': 2})
+    assert response.status_code == 201
+    pin = response.headers['X-DB-Primary-Until']
+    client.delete_cookie('db_primary_until')
+
+    assert client.get('/orders').json == []
+    assert len(client.get('/orders', headers={'X-DB-Primary-Until': pin}).json) == 1
+
+
+def test_pins_too_far_away_are_ignored(client):
+    response = client.post('/orders', json={'table_number': 1, 'number_of_people': 2})
+    assert response.status_code == 201
+    client.delete_cookie('db_primary_until')
+    assert client.get('/orders', headers={'X-DB-Primary-Until': '9999999999'}).json == []
@@ -0,0 +1,69 @@
+from datetime import date
+from sqlalchemy import text
+from models import db, Order, OrderItem, SalesRollup
+from test_orders import add_orders
+from conftest import make_app, MIGRATIONS_DIR
+
+
+def close_all(client):
+    for order_id in db.session.scalars(db.select(Order.id)).all():
+        assert client.post('/orders/%d/close' % order_id).status_code == 200
+
+
+def report(client, group_by):
+    today = date.today().isoformat()
+    response = client.get('/reports/sales?from=%s&to=%s&group_by=%s' % (today, today, group_by))
+    assert response.status_code == 200
+    return response.json
+
+
+def test_orders_without_a_table_add_up_in_one_rollup_row(client):
+    add_orders(2)
+    db.session.execute(db.update(Order).values(table_number=None))
+    db.session.commit()
+    close_all(client)
+
+    assert db.session.query(SalesRollup).count() == 3
+    [row] = report(client, 'table')
+    assert row['table'] is None
+    assert row['quantity'] == 6
+    assert row['revenue'] == 54
+
+
+def test_rollup_totals_by_day_table_and_item(client):
+    add_orders(12)
+    close_all(client)
+
+    [day] = report(client, 'day')
+    assert (day['quantity'], day['revenue']) == (36, 324)
+    tables = {row['table']: row['quantity'] for row in report(client, 'table')}
+    assert tables[0] == tables[1] == 6
+    assert sum(tables.values()) == 36
+    items = {row['item_type']: row['revenue'] for row in report(client, 'item')}
+    assert items == {'food': 60, 'store': 24, 'aquatic': 240}
+
+
+def test_a_closed_order_is_not_rolled_up_twice(client):
+    add_orders(1)
+    close_all(client)
+    order_id = db.session.scalar(db.select(Order.id))
+    assert client.post('/orders/%d/close' % order_id).status_code == 409
+    assert report(client, 'day')[0]['quantity'] == 3
+
+
+def test_migration_merges_the_rows_the_nulls_kept_apart(tmp_path):
+    from flask_migrate import upgrade
+    app = make_app(tmp_path, ENABLE_MIGRATE=True)
+    with app.app_context():
+        upgrade(directory=MIGRATIONS_DIR, revision='c3f8a1d6e204')
+        for quantity in (1, 2):
+            db.session.execute(text(
+                "INSERT INTO sales_rollup (day, item_type, item_id, table_number, quantity, revenue) "
+                "VALUES ('2026-10-18', 'food', 1, NULL, :quantity, :revenue)"
+            ), {'quantity': quantity, 'revenue': quantity * 5})
+        db.session.commit()
+
+        upgrade(directory=MIGRATIONS_DIR)
+        [row] = db.session.query(SalesRollup).all()
+        assert (row.table_number, row.quantity, row.revenue) == (-1, 3, 15)
+        db.session.remove()
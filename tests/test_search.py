@@ -0,0 +1,66 @@
+import pytest
+from search import name_index, normalize, trigrams
+
+
+@pytest.fixture(autouse=True)
+def fresh_index():
+    # The index lives as long as the worker, the versions of a new cache directory may repeat within a second
+    name_index._versions = None
+
+
+def add(client, url, *names):
+    body = 'name,price\n' + ''.join('%s,1\n' % name for name in names)
+    assert client.post(url, data=body.encode(), content_type='text/csv').json['error_count'] == 0
+
+
+def search(client, query, **args):
+    response = client.get('/search', query_string=dict(args, q=query))
+    assert response.status_code == 200
+    return response
+
+
+def test_normalize_and_trigrams_follow_pg_trgm():
+    assert normalize('  Patacón  Maduro ') == 'patacon maduro'
+    assert trigrams('cat') == {'  c', ' ca', 'cat', 'at '}
+
+
+def test_matches_are_ranked_exact_prefix_word_then_fuzzy(client):
+    add(client, '/fooditems/import', 'Arepa', 'Arepa Reina', 'Mini arepa', 'Patacón')
+    add(client, '/aquaticitems/import', 'Arepas de mar')
+
+    names = [item['name'] for item in search(client, 'arepa').json]
+    assert names == ['Arepa', 'Arepa Reina', 'Arepas de mar', 'Mini arepa']
+    assert search(client, 'arepa').json[0]['score'] == 3.0
+    # Only one name starts with 'arepas', the others come after it as fuzzy matches
+    found = search(client, 'arepas').json
+    assert (found[0]['item_type'], found[0]['score']) == ('aquatic', 2.0)
+    assert all(item['score'] < 1 for item in found[1:])
+    assert [item['name'] for item in search(client, 'patacon').json] == ['Patacón']
+    # A typo still finds the item by its trigrams
+    assert [item['name'] for item in search(client, 'pataconn').json] == ['Patacón']
+
+
+def test_pages_link_to_the_next_one(client):
+    add(client, '/storeitems/import', *['Agua %d' % number for number in range(5)])
+
+    first = search(client, 'agua', limit=3)
+    assert len(first.json) == 3
+    assert 'offset=3' in first.headers['Link']
+    rest = search(client, 'agua', limit=3, offset=3)
+    assert [item['name'] for item in rest.json] == ['Agua 3', 'Agua 4']
+    assert 'Link' not in rest.headers
+
+
+def test_renamed_items_are_found_by_their_new_name(client):
+    add(client, '/fooditems/import', 'Cachapa')
+    assert search(client, 'cachapa').json
+    [item] = client.get('/fooditems').json
+    response = client.patch('/fooditems/%d' % item['id'], json={'version': item['version'], 'name': 'Tequeño'})
+    assert response.status_code == 200
+
+    assert search(client, 'cachapa').json == []
+    assert [item['name'] for item in search(client, 'tequeno').json] == ['Tequeño']
+
+
+def test_the_query_is_required(client):
+    assert client.get('/search?q=%20').status_code == 400